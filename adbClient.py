@@ -0,0 +1,434 @@
+'''adbClient -- Talk to the adb server (the background process that 'adb start-server'
+  runs, listening on localhost port 5037) directly over a socket, rather than starting
+  an 'adb' client program for every command.
+
+  execute() takes the same arguments as ribou.execute() for 'adb ...' commands, and
+  is what examImg.executeAdb uses.  Commands it doesn't know how to do itself (or any
+  command, if the adb server isn't running) are passed on to the real adb program.
+
+  Each shell command needs its own connection (the adb server closes it when the
+  command finishes) but sync (push/pull) connections are kept open and reused, one
+  pool of them per device.
+'''
+
+import sys, os, time, socket, struct, threading, hashlib, io, errno, weakref
+import ribou
+
+enabled = True  # Set False to always run the adb program (reviveMC74 -a option)
+serverHost = "127.0.0.1"
+serverPort = int(os.environ.get("ANDROID_ADB_SERVER_PORT", "5037"))
+timeout = 300  # Seconds to wait for a response (dd of a big partition can take a while)
+syncChunk = 64*1024  # Max size of a sync DATA packet
+
+stats = None  # Function called (verb, secs, bytes in, bytes out) after each execute() it does
+
+_syncPool = {}  # {serial: [idle syncConn, ...]}
+cancelled = set()  # Serials that have been given up on: transport() refuses to connect to them
+_devSocks = {}  # {serial: WeakSet of the sockets connected through to it, pooled or in use}
+_poolLock = threading.Lock()
+
+
+class adbError(Exception):
+  '''The adb server or device returned FAIL (the message is like the adb program's)'''
+  pass
+
+
+def _recvAll(sock, size):
+  data = []
+  while size>0:
+    buf = sock.recv(min(size, 256*1024))
+    if len(buf)==0:
+      raise socket.error("connection closed by adb server")
+    data.append(buf)
+    size -= len(buf)
+  return b''.join(data)
+
+
+def _readToEnd(sock):
+  data = []
+  while True:
+    buf = sock.recv(256*1024)
+    if len(buf)==0:
+      return b''.join(data)
+    data.append(buf)
+
+
+def _request(sock, req):
+  '''Send a length prefixed request to the adb server and check for OKAY'''
+  req = req.encode("utf-8") if type(req)!=bytes else req
+  sock.sendall(("%04x" % len(req)).encode("ascii")+req)
+  status = _recvAll(sock, 4)
+  if status!=b"OKAY":
+    msg = _recvAll(sock, int(_recvAll(sock, 4), 16)) if status==b"FAIL" else status
+    raise adbError(msg.decode("utf-8", "replace"))
+
+
+class noServerError(socket.error):
+  '''Nothing is listening on the adb server port (so nothing was sent to the device)'''
+  pass
+
+
+def _connect():
+  try:
+    return socket.create_connection((serverHost, serverPort), timeout)
+  except socket.error as ex:
+    if ex.errno in [errno.ECONNREFUSED, getattr(errno, "WSAECONNREFUSED", -1)]:
+      raise noServerError(ex.errno, str(ex))
+    raise
+
+
+def hostQuery(req):
+  '''Send a host: request (ie 'host:devices') and return its (length prefixed) reply'''
+  sock = _connect()
+  try:
+    _request(sock, req)
+    return _recvAll(sock, int(_recvAll(sock, 4), 16))
+  finally:
+    sock.close()
+
+
+def transport(serial):
+  '''Return a socket to the adb server that is connected through to the device'''
+  _checkCancelled(serial)
+  sock = _connect()
+  try:
+    _request(sock, "host:transport:"+serial if serial else "host:transport-any")
+    with _poolLock:  # (So cancel() either sees it, or it sees the cancel)
+      _checkCancelled(serial)
+      _devSocks.setdefault(serial, weakref.WeakSet()).add(sock)
+  except:
+    sock.close()
+    raise
+  return sock
+
+
+def _checkCancelled(serial):
+  if serial in cancelled:
+    raise adbError("device '"+serial+"' was given up on")
+
+
+def service(serial, svc):
+  '''Open a device service (ie 'shell:ls', 'reboot:bootloader') and return the socket'''
+  sock = transport(serial)
+  try:
+    _request(sock, svc)
+  except:
+    sock.close()
+    raise
+  return sock
+
+
+def shell(serial, cmd):
+  '''Run a shell command on the device, returns its output (bytes)'''
+  sock = service(serial, "shell:"+cmd)
+  try:
+    out = _readToEnd(sock)
+    _checkCancelled(serial)  # (cancel() shut it down, the output was cut short)
+    return out
+  finally:
+    sock.close()
+
+
+def pullStream(serial, remote, fp, limit=None):
+  '''Copy a file (or block device) from the device to the open binary file 'fp', with
+  nothing staged on the device, hashing it on the way.  Uses the 'exec:' service (adb
+  exec-out) if adbd has it, and a sync RECV of the file if not (older adbd's, like the
+  MC74's).  Stops after 'limit' bytes if given.  Returns [size, md5 hex digest].
+  '''
+  md5 = hashlib.md5()
+  size = 0
+  try:
+    sock = service(serial, "exec:cat "+remote+" 2>/dev/null")
+    try:
+      while limit==None or size<limit:
+        data = sock.recv(256*1024 if limit==None else min(256*1024, limit-size))
+        if len(data)==0:
+          break
+        fp.write(data)
+        md5.update(data)
+        size += len(data)
+      _checkCancelled(serial)
+    finally:
+      sock.close()
+    return [size, md5.hexdigest()]
+  except adbError:
+    pass  # No exec: service on this device
+
+  sc = syncConn(serial)  # (Not from the pool, we may abandon it part way through a file)
+  done = False
+  try:
+    sc._send(b"RECV", remote)
+    while limit==None or size<limit:
+      id, dSize = sc._reply()
+      if id==b"DONE":
+        done = True
+        break
+      data = _recvAll(sc.sock, dSize)
+      if limit!=None:
+        data = data[:limit-size]
+      fp.write(data)
+      md5.update(data)
+      size += len(data)
+  finally:
+    if done:
+      sc.close()
+    else:
+      sc.sock.close()
+  return [size, md5.hexdigest()]
+
+
+def devices():
+  '''Return the 'adb devices' list of [serial, state]'''
+  devs = []
+  for ln in _str(hostQuery("host:devices")).split('\n'):
+    if '\t' in ln:
+      devs.append(ln.split('\t'))
+  return devs
+
+
+def trackDevices():
+  '''Yield the 'adb devices' list of [serial, state] now, and again each time a device
+  comes, goes or changes state (the adb server's 'host:track-devices' stream).  Runs
+  until the adb server goes away (socket.error).
+  '''
+  sock = _connect()
+  try:
+    _request(sock, "host:track-devices")
+    sock.settimeout(None)  # (Nothing may happen for a long time)
+    while True:
+      data = _str(_recvAll(sock, int(_recvAll(sock, 4), 16)))
+      yield [ln.split('\t') for ln in data.split('\n') if '\t' in ln]
+  finally:
+    sock.close()
+
+
+class syncConn(object):
+  '''A sync: session with the device, used for push, pull and stat'''
+  def __init__(self, serial):
+    self.serial = serial
+    self.sock = service(serial, "sync:")
+
+  def _send(self, id, data):
+    data = data.encode("utf-8") if type(data)!=bytes else data
+    self.sock.sendall(id+struct.pack("<I", len(data))+data)
+
+  def _reply(self):
+    id = _recvAll(self.sock, 4)
+    size = struct.unpack("<I", _recvAll(self.sock, 4))[0]
+    if id==b"FAIL":
+      raise adbError(_recvAll(self.sock, size).decode("utf-8", "replace"))
+    return id, size
+
+  def stat(self, remote):
+    '''Return [mode, size, mtime] of a file on the device (mode 0 if it doesn't exist)'''
+    self._send(b"STAT", remote)
+    if _recvAll(self.sock, 4)!=b"STAT":
+      raise adbError("bad STAT reply")
+    return list(struct.unpack("<III", _recvAll(self.sock, 12)))
+
+  def push(self, localFid, remote, mode=None):
+    '''Copy a local file to the device, returns the number of bytes sent'''
+    st = os.stat(localFid)
+    with open(localFid, 'rb') as fp:
+      return self.pushFp(fp, remote, st.st_mode if mode==None else mode, st.st_mtime)
+
+  def pushData(self, data, remote, mode=0o100644):
+    '''Write a buffer to a file on the device'''
+    return self.pushFp(io.BytesIO(data), remote, mode, time.time())
+
+  def pushFp(self, fp, remote, mode, mtime):
+    '''Copy what can be read from 'fp' to a file on the device.  (Note: adbd removes
+    'remote' first, so never push directly to a block device.)
+    '''
+    size = 0
+    self._send(b"SEND", remote+","+str(mode))
+    while True:
+      data = fp.read(syncChunk)
+      if len(data)==0:
+        break
+      self._send(b"DATA", data)
+      size += len(data)
+    self.sock.sendall(b"DONE"+struct.pack("<I", int(mtime)))
+    self._reply()  # OKAY, or raises adbError on FAIL
+    return size
+
+  def pullData(self, remote):
+    '''Read a file from the device into memory'''
+    data = []
+    self._send(b"RECV", remote)
+    while True:
+      id, dSize = self._reply()
+      if id==b"DONE":
+        break
+      if id!=b"DATA":
+        raise adbError("bad RECV reply")
+      data.append(_recvAll(self.sock, dSize))
+    return b''.join(data)
+
+  def pull(self, remote, localFid):
+    '''Copy a file from the device to a local file, returns the number of bytes'''
+    size = 0
+    self._send(b"RECV", remote)
+    fp = None
+    try:
+      while True:
+        id, dSize = self._reply()
+        if id==b"DONE":
+          break
+        if id!=b"DATA":
+          raise adbError("bad RECV reply")
+        if fp==None:  # (Don't create the local file unless the remote one exists)
+          fp = open(localFid, 'wb')
+        fp.write(_recvAll(self.sock, dSize))
+        size += dSize
+    finally:
+      if fp:
+        fp.close()
+    if fp==None:
+      open(localFid, 'wb').close()  # Remote file was empty
+    return size
+
+  def close(self):
+    try:
+      self._send(b"QUIT", b"")
+    except socket.error:
+      pass
+    self.sock.close()
+
+
+class syncSession(object):
+  ''''with syncSession(serial) as sc:' borrows an open sync connection to the device
+  from the pool (or makes a new one), and puts it back when done
+  '''
+  def __init__(self, serial):
+    self.serial = serial or ""
+
+  def __enter__(self):
+    with _poolLock:
+      idle = _syncPool.setdefault(self.serial, [])
+      self.conn = idle.pop() if idle else None
+    if self.conn==None:
+      self.conn = syncConn(self.serial)
+    return self.conn
+
+  def __exit__(self, exType, exValue, tb):
+    if exType==None or exType==adbError:  # (FAIL replies leave the session usable)
+      with _poolLock:
+        _syncPool.setdefault(self.serial, []).append(self.conn)
+    else:
+      self.conn.sock.close()  # Socket errors, the connection is probably broken
+
+
+def closeAll(serial=None):
+  '''Close the pooled sync connections (just the device's, if a serial is given)'''
+  with _poolLock:
+    for sn in list(_syncPool.keys()):
+      if serial==None or sn==serial:
+        for conn in _syncPool.pop(sn):
+          conn.close()
+
+
+def cancel(serial):
+  '''Give up on a device: from now on transport() refuses it, and the connections to it
+  (pooled, or in use, ie by a long dd) are shut down, so whatever is using them fails
+  now rather than when it finishes.  (Remove it from 'cancelled' to use it again.)
+  '''
+  with _poolLock:
+    cancelled.add(serial)
+    socks = list(_devSocks.pop(serial, []))
+  closeAll(serial)
+  for sock in socks:
+    try:
+      sock.shutdown(socket.SHUT_RDWR)
+    except socket.error:
+      pass  # (It was closed already)
+
+
+def push(serial, localFid, remote):
+  with syncSession(serial) as sc:
+    st = sc.stat(remote)
+    if st[0]&0o170000==0o040000:  # Remote is a directory, push into it
+      remote = remote.rstrip('/')+'/'+os.path.basename(localFid)
+    return sc.push(localFid, remote)
+
+
+def pull(serial, remote, localFid):
+  if os.path.isdir(localFid):
+    localFid = os.path.join(localFid, remote.rstrip('/').split('/')[-1])
+  with syncSession(serial) as sc:
+    return sc.pull(remote, localFid)
+
+
+def install(serial, apkFid, opts):
+  '''Install an .apk the way adb does on older Androids, push it to /data/local/tmp,
+  'pm install' it, and remove it
+  '''
+  tmpFid = "/data/local/tmp/"+os.path.basename(apkFid)
+  push(serial, apkFid, tmpFid)
+  try:
+    return shell(serial, "pm install "+' '.join(opts+[tmpFid]))
+  finally:
+    shell(serial, "rm "+tmpFid)
+
+
+def _str(bb):
+  '''Convert output bytes to a str, like ribou.execute does'''
+  return bb if str==bytes else bb.decode("ISO-8859-1")
+
+
+def _xferMsg(size, startTm):
+  secs = max(time.time()-startTm, 0.001)
+  return "%d KB/s (%d bytes in %.3fs)\n" % (size/1024/secs, size, secs)
+
+
+def execute(cmd, showErr=True, returnStr=True):
+  '''Drop in replacement for ribou.execute for 'adb [-s serial] ...' commands.  Returns
+  (output, rc) like the adb program would.
+  '''
+  tok = cmd.split(' ') if type(cmd)==str else list(cmd)
+  tok = [xx for xx in tok if xx!='']
+  if not enabled or len(tok)<2 or tok[0]!="adb":
+    return ribou.execute(cmd, showErr, returnStr)
+  args = tok[1:]
+  serial = None
+  if args[0]=='-s' and len(args)>2:
+    serial = args[1]
+    args = args[2:]
+  verb = args[0]
+
+  try:
+    startTm = time.time()
+    bytesIn, bytesOut = 0, 0
+    if verb=="shell" and len(args)>1:
+      out = _str(shell(serial, ' '.join(args[1:])))
+      bytesIn, bytesOut = len(out), len(' '.join(args[1:]))
+    elif verb=="push" and len(args)==3:
+      bytesOut = push(serial, args[1], args[2])
+      out = _xferMsg(bytesOut, startTm)
+    elif verb=="pull" and len(args)==3:
+      bytesIn = pull(serial, args[1], args[2])
+      out = _xferMsg(bytesIn, startTm)
+    elif verb=="uninstall" and len(args)==2:
+      out = _str(shell(serial, "pm uninstall "+args[1]))
+    elif verb=="install" and len(args)>1:
+      out = _str(install(serial, args[-1], args[1:-1]))
+      bytesOut = os.path.getsize(args[-1])
+    elif verb=="reboot" and len(args)<=2:
+      service(serial, "reboot:"+(args[1] if len(args)>1 else "")).close()
+      out = ""
+    elif verb in ["connect", "disconnect"] and len(args)==2:
+      out = _str(hostQuery("host:"+verb+":"+args[1]))+"\n"  # (ie 'connected to host:5555')
+    elif verb=="devices" and len(args)==1:
+      out = "List of devices attached\n"+''.join([dv[0]+'\t'+dv[1]+'\n' for dv in devices()])
+    else:
+      return ribou.execute(cmd, showErr, returnStr)  # Let the adb program do it
+  except noServerError:
+    # The adb server isn't running, the adb program will start it, next time we'll use it
+    return ribou.execute(cmd, showErr, returnStr)
+  except (adbError, socket.error, IOError, OSError) as ex:
+    # (Once the request is sent, the device may have done it, so it's not done again)
+    return "error: "+str(ex)+"\n", 1
+  if stats:
+    stats(verb, time.time()-startTm, bytesIn, bytesOut)
+  return out, 0
+
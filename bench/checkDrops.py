@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+'''checkDrops -- Check that installApps gets done on a simulated MC74 (fakeMC74.py) whose
+  USB cable keeps dropping out
+
+  python bench/checkDrops.py
+
+  Runs bench/runBench.py (installApps only) with the cable dropping out every 6MB, and
+  every 3MB (more often than the apps, pushed all at once, take to send).  Exits with 1
+  if either run fails.
+'''
+
+import sys, os, subprocess, tempfile
+benchDir = os.path.dirname(os.path.abspath(__file__))
+
+runs = [["rebootSecs=0.5", "dropEvery=6000000", "objectives=installApps", "runs=1"],
+  ["rebootSecs=0.5", "dropEvery=3000000", "objectives=installApps", "runs=1"]]
+
+
+def checkMain(args):
+  if args:
+    print(__doc__)
+    return False
+  fails = []
+  for run in runs:
+    dir = tempfile.mkdtemp(prefix="fakeMC74")
+    with open(dir+"/bench.log", 'w') as fp:
+      rc = subprocess.call([sys.executable, os.path.join(benchDir, "runBench.py"), "dir="+dir,
+        "out="+dir+"/bench_output.txt"]+run, stdout=fp, stderr=subprocess.STDOUT)
+    what = ' '.join(run)+" (log in "+dir+"/bench.log)"
+    print(("  ok      " if rc==0 else "  FAILED  ")+what)
+    if rc!=0:
+      fails.append(what)
+  print("drops: "+("all ok" if not fails else str(len(fails))+" FAILED"))
+  return not fails
+
+
+if __name__ == "__main__":
+  sys.exit(0 if checkMain(sys.argv[1:]) else 1)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+'''checkSqlBatch -- Check that examImg.sqlBatch changes the database all or nothing, on a
+  simulated MC74 (fakeMC74.py)
+
+  python bench/checkSqlBatch.py [dir=...]
+
+  A batch whose statements all work must change the launcher's favorites table, one with
+  a statement that fails must leave it as it was.  Exits with 1 if not.
+'''
+
+import sys, os, tempfile, shutil
+benchDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, benchDir)
+sys.path.insert(0, os.path.dirname(benchDir))
+import fakeMC74
+from ribou import bunch
+
+
+def checkMain(args):
+  opt = dict(dir="")
+  for tok in args:
+    nm, val = tok.split('=', 1)
+    if nm not in opt:
+      print(__doc__)
+      return False
+    opt[nm] = val
+  dir = os.path.abspath(opt["dir"] or tempfile.mkdtemp(prefix="fakeMC74"))
+  devDir, hostDir = dir+"/phone", dir+"/host"
+  for dd in [devDir, hostDir]:
+    if os.path.isdir(dd):
+      shutil.rmtree(dd)
+    os.makedirs(dd)
+
+  fakeMC74.makeDevice(devDir, mode="device")
+  server = fakeMC74.fakeAdbServer(devDir).start()
+  os.environ["ANDROID_ADB_SERVER_PORT"] = str(server.port)
+  os.chdir(hostDir)
+  import examImg, adbClient
+  adbClient.serverPort = server.port
+  sys.arg = bunch(serial=server.serial)
+
+  fails = []
+  def check(what, ok):
+    print(("  ok      " if ok else "  FAILED  ")+what)
+    if not ok:
+      fails.append(what)
+
+  db = examImg.launcherDb
+  before = examImg.dbGetRows(db, "favorites")
+  check("favorites table read", bool(before))
+
+  bat = examImg.sqlBatch(db)
+  bat.setCell("favorites", "_id", before[0]._id, "title", "Changed")
+  bat.add("insert into noSuchTable (x) values (1)")
+  bat.add("delete from favorites")
+  res = bat.run()
+  check("failed batch returns results", res!=None and len(res)==3)
+  check("failed statement has sqlite3's error", res and "noSuchTable" in str(res[1].error))
+  check("statement before it is rolled back", res and res[0].error=="rolled back"
+    and res[0].changes==0)
+  check("statement after it is not run", res and res[2].error=="not run")
+  check("no rows changed", examImg.dbGetRows(db, "favorites")==before)
+
+  bat = examImg.sqlBatch(db)
+  bat.setCell("favorites", "_id", before[0]._id, "title", "Changed")
+  res = bat.run()
+  check("good batch works", res and res[0].error==None and res[0].changes==1)
+  after = examImg.dbGetRows(db, "favorites")
+  check("good batch changed the row", after and after[0].title=="Changed"
+    and after[1:]==before[1:])
+
+  adbClient.closeAll()
+  server.stop()
+  print("sqlBatch: "+("all ok" if not fails else str(len(fails))+" FAILED"))
+  return not fails
+
+
+if __name__ == "__main__":
+  sys.exit(0 if checkMain(sys.argv[1:]) else 1)
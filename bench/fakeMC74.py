@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+'''fakeMC74 -- A simulated MC74, so reviveMC74 can be timed without a phone.
+
+  makeDevice(dir) builds a directory tree that stands in for the phone's filesystem
+  (dir/root, with /dev/block/platform/sdhci.1/by-name/*, /data, /cache, /system and
+  /sdcard) and fakeAdbServer serves the adb server protocol for it: host:devices,
+  host:track-devices, host:connect, host:transport, shell: (run by the host's /bin/sh,
+  with the programs in bench/device first in the PATH and absolute paths moved under
+  dir/root), sync: (STAT, RECV, SEND) and reboot:.  'latency' seconds are added to each
+  request, and transfers are limited to 'bandwidth' bytes/sec.  With 'dropEvery', the USB
+  cable drops out after every that many bytes of sync data: the connection is closed and
+  the phone is gone for 'dropSecs' seconds.  Give it a serial like '10.0.0.5:5555' to
+  have it stand in for a phone on the network (that host:connect connects to).
+
+  The phone's mode (recovery, device, fastboot or off while it reboots) is kept in
+  dir/mode, so the fake fastboot program (bench/fastboot) can see and change it too.
+
+  python fakeMC74.py [port [dir]]  makes a device and runs the server by itself.
+'''
+
+import sys, os, time, json, re, socket, struct, subprocess, threading, sqlite3
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ribou import bunch
+import bootImg
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+partDir = "/dev/block/platform/sdhci.1/by-name"
+partSize = 8192*1024  # Size of the boot, boot2 and recovery partitions
+
+defaultProp = b"ro.secure=1\nro.debuggable=0\npersist.meraki.usb_debug=0\n"
+initRc = b"on init\n    export PATH /sbin:/system/bin\n    symlink /system/etc /etc\n" \
+  b"    mkdir /data\n"
+launcherCols = ["_id INTEGER PRIMARY KEY", "title TEXT", "intent TEXT", "container INTEGER",
+  "screen INTEGER", "cellX REAL", "cellY REAL", "spanX REAL", "spanY REAL", "itemType INTEGER",
+  "appWidgetId INTEGER", "iconType INTEGER", "iconResource TEXT", "flags INTEGER",
+  "profileId INTEGER", "restored INTEGER", "zOrder INTEGER", "flingAsTap TEXT",
+  "hotSeatRank INTEGER"]
+
+
+def makeBootImg():
+  '''Return an 8MB boot partition image, with a ramdisk like the MC74's'''
+  ramdisk = bootImg.writeCpio([
+    bunch(name="default.prop", mode=0o100644, data=defaultProp),
+    bunch(name="init.rc", mode=0o100750, data=initRc),
+    bunch(name="sbin", mode=0o040755),
+    bunch(name="sbin/adbd", mode=0o100750, data=os.urandom(200*1024)),
+  ])
+  img = bootImg.writeBootImg(bunch(pageSize=2048, base=0x80000000, board="", cmdline="",
+    kernel=os.urandom(3*1024*1024), ramdisk=bootImg.gzipData(ramdisk), second=b""))
+  return img+b'\0'*(partSize-len(img))
+
+
+def makeDevice(dir, mode="recovery"):
+  '''Build (or rebuild) the simulated phone's filesystem in dir/root.  It starts in
+  'mode', with the replacement recovery already installed (ro.secure=0 in recovery).
+  '''
+  root = os.path.join(dir, "root")
+  if os.path.isdir(root):
+    subprocess.call(["rm", "-rf", root])
+  for sub in [partDir, "/data/app", "/data/local/tmp", "/data/property", "/cache",
+      "/system/app", "/system/bin", "/system/etc", "/sdcard", "/proc",
+      "/data/data/com.teslacoilsw.launcher/databases"]:
+    os.makedirs(root+sub)
+  boot = makeBootImg()
+  for part in ["boot", "boot2", "recovery"]:
+    with open(root+partDir+'/'+part, 'wb') as fp:
+      fp.write(boot)
+  with open(root+partDir+"/u-boot-env", 'wb') as fp:
+    fp.write(b"bootcmd=run bootemmc\0ver=U-Boot 2011.06 (MC74)\0"+b'\0'*(128*1024-44))
+  with open(root+"/default.prop", 'wb') as fp:  # (The recovery's, adb shell starts in /)
+    fp.write(b"ro.secure=0\n")
+  for fn in ["click", "sh"]:
+    open(root+"/system/bin/"+fn, 'wb').close()
+  for fn in ["DroidNode.apk", "DroidNodeSystemSvcs.apk"]:
+    with open(root+"/system/app/"+fn, 'wb') as fp:
+      fp.write(os.urandom(64*1024))
+
+  db = sqlite3.connect(root+"/data/data/com.teslacoilsw.launcher/databases/launcher.db")
+  db.execute("create table favorites ("+', '.join(launcherCols)+")")
+  rows = [[1, "Apps", "", -101, 0, 0.0, 0.0, 1.0, 1.0, 0, -1, 0, "", 0, -1, 0, 0, "false", 2],
+    [2, "Phone", "#Intent;component=com.meraki.dialer2/.Dialer;end", -101, 0, 1.0, 0.0, 1.0,
+      1.0, 0, -1, 0, "", 0, -1, 0, 0, "false", 0],
+    [3, "Google", "", -100, 0, 0.0, 0.0, 1.0, 1.0, 2, -1, 0, "", 0, -1, 0, 0, "false", 0],
+    [4, "Create", "", -100, 0, 1.0, 0.0, 1.0, 1.0, 2, -1, 0, "", 0, -1, 0, 0, "false", 0],
+    [5, None, "", -100, 0, 0.0, 1.0, 5.0, 1.0, 4, 1, 0, "", 0, -1, 0, 0, "false", 0]]
+  db.executemany("insert into favorites values ("+','.join(['?']*len(launcherCols))+")", rows)
+  db.commit()
+  db.close()
+  setMode(dir, mode)
+
+
+def getMode(dir):
+  '''Return the phone's mode: 'recovery', 'device' (normal), 'fastboot', or 'off' while it
+  reboots
+  '''
+  try:
+    with open(os.path.join(dir, "mode")) as fp:
+      md = json.load(fp)
+  except (IOError, OSError, ValueError):
+    return "off"
+  if md["mode"]=="off" and time.time()>=md["until"]:
+    return md["next"]
+  return md["mode"]
+
+
+def setMode(dir, mode, rebootSecs=0):
+  '''Put the phone in 'mode', after 'rebootSecs' seconds of being off'''
+  md = dict(mode="off", until=time.time()+rebootSecs, next=mode) if rebootSecs else \
+    dict(mode=mode)
+  tmpFid = os.path.join(dir, "mode.tmp")
+  with open(tmpFid, 'w') as fp:
+    json.dump(md, fp)
+  os.rename(tmpFid, os.path.join(dir, "mode"))
+
+
+class fakeAdbServer(object):
+  '''The adb server for the simulated phone in 'dir', listening on localhost 'port' (0
+  picks a free port, see self.port)
+  '''
+  def __init__(self, dir, port=0, serial="FAKEMC74", latency=0.0, bandwidth=None,
+      rebootSecs=2.0, dropEvery=0, dropSecs=2.0):
+    self.dir = os.path.abspath(dir)
+    self.root = os.path.join(self.dir, "root")
+    self.serial = serial
+    self.latency = latency
+    self.bandwidth = bandwidth
+    self.rebootSecs = rebootSecs
+    self.dropEvery = dropEvery
+    self.dropSecs = dropSecs
+    self.synced = 0  # Bytes of sync data since the last drop
+    self.lock = threading.Lock()
+    self.sock = socket.socket()
+    self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self.sock.bind(("127.0.0.1", port))
+    self.sock.listen(50)
+    self.port = self.sock.getsockname()[1]
+    self.stopped = False
+
+  def start(self):
+    th = threading.Thread(target=self.serve)
+    th.daemon = True
+    th.start()
+    return self
+
+  def stop(self):
+    '''Stop serving (track-devices streams end within 0.1 sec)'''
+    self.stopped = True
+    self.sock.close()
+
+  def serve(self):
+    while not self.stopped:
+      try:
+        conn, addr = self.sock.accept()
+      except socket.error:
+        break  # (stop() closed the socket)
+      th = threading.Thread(target=self._handle, args=(conn,))
+      th.daemon = True
+      th.start()
+
+  def _throttle(self, size):
+    if self.bandwidth:
+      time.sleep(float(size)/self.bandwidth)
+
+  def _dropped(self, size):
+    '''Count 'size' bytes of sync data, returns True if the cable drops out now'''
+    if not self.dropEvery:
+      return False
+    with self.lock:
+      self.synced += size
+      if self.synced<self.dropEvery:
+        return False
+      self.synced = 0
+    mode = getMode(self.dir)
+    if mode!="off":
+      setMode(self.dir, mode, self.dropSecs)
+    return True
+
+  def _recv(self, conn, size):
+    data = b""
+    while len(data)<size:
+      buf = conn.recv(size-len(data))
+      if len(buf)==0:
+        raise EOFError()
+      data += buf
+    return data
+
+  def _req(self, conn):
+    return self._recv(conn, int(self._recv(conn, 4), 16)).decode("ISO-8859-1")
+
+  def _reply(self, conn, data):
+    data = data.encode("ISO-8859-1") if type(data)!=bytes else data
+    conn.sendall(("%04x" % len(data)).encode("ascii")+data)
+
+  def _fail(self, conn, msg):
+    conn.sendall(b"FAIL")
+    self._reply(conn, msg)
+
+  def _devices(self):
+    mode = getMode(self.dir)
+    return self.serial+'\t'+mode+'\n' if mode in ["recovery", "device"] else ""
+
+  def _path(self, path):
+    return self.root+path if path.startswith('/') else os.path.join(self.root, path)
+
+  def _handle(self, conn):
+    try:
+      time.sleep(self.latency)
+      req = self._req(conn)
+      if req=="host:version":
+        conn.sendall(b"OKAY")
+        self._reply(conn, "001f")
+      elif req=="host:devices":
+        conn.sendall(b"OKAY")
+        self._reply(conn, self._devices())
+      elif req=="host:track-devices":
+        conn.sendall(b"OKAY")
+        last = None
+        while not self.stopped:
+          devs = self._devices()
+          if devs!=last:
+            self._reply(conn, devs)
+            last = devs
+          time.sleep(0.1)
+      elif req.startswith("host:connect:") or req.startswith("host:disconnect:"):
+        verb, addr = req.split(':', 2)[1:]  # (A serial like 'host:5555' says it's on TCP)
+        conn.sendall(b"OKAY")
+        if verb=="disconnect":
+          self._reply(conn, "disconnected "+addr)
+        elif addr==self.serial and self._devices()!="":
+          self._reply(conn, "already connected to "+addr)
+        else:
+          self._reply(conn, "failed to connect to "+addr)
+      elif req.startswith("host:transport"):
+        serial = req.split(':', 2)[2] if req.startswith("host:transport:") else self.serial
+        if serial!=self.serial or self._devices()=="":
+          self._fail(conn, "device '"+serial+"' not found")
+          return
+        conn.sendall(b"OKAY")
+        self._service(conn, self._req(conn))
+      else:
+        self._fail(conn, "unknown host service")
+    except (EOFError, socket.error):
+      pass
+    finally:
+      conn.close()
+
+  def _service(self, conn, svc):
+    if svc.startswith("shell:"):
+      conn.sendall(b"OKAY")
+      conn.sendall(self.shell(svc[6:]))
+    elif svc.startswith("reboot:"):
+      conn.sendall(b"OKAY")
+      setMode(self.dir, dict(bootloader="fastboot", recovery="recovery").get(svc[7:], "device"),
+        self.rebootSecs)
+    elif svc=="sync:":
+      conn.sendall(b"OKAY")
+      self._sync(conn)
+    else:
+      self._fail(conn, "closed")  # (Like adbd, which has no exec: service)
+
+  def shell(self, cmd):
+    '''Run a device shell command, returns its output (with \\r\\n's, like the MC74's pty)'''
+    cmd = re.sub(r"(^|[\s=<>;|(])/", lambda mm: mm.group(1)+self.root+'/', cmd)
+    env = dict(os.environ, PATH=os.path.join(benchDir, "device")+os.pathsep+os.environ["PATH"],
+      FAKEMC74_ROOT=self.root)
+    proc = subprocess.Popen(["/bin/sh", "-c", cmd], stdout=subprocess.PIPE,
+      stderr=subprocess.STDOUT, cwd=self.root, env=env)
+    out = proc.communicate()[0]
+    sysrq = self.root+"/proc/sysrq-trigger"
+    if os.path.isfile(sysrq):  # 'echo b >/proc/sysrq-trigger' reboots
+      os.remove(sysrq)
+      setMode(self.dir, "device", self.rebootSecs)
+    self._throttle(len(out))
+    return out.replace(b'\n', b'\r\n')
+
+  def _sync(self, conn):
+    while True:
+      id = self._recv(conn, 4)
+      size = struct.unpack("<I", self._recv(conn, 4))[0]
+      if id==b"QUIT":
+        return
+      path = self._recv(conn, size).decode("utf-8")
+      if id==b"STAT":
+        try:
+          st = os.stat(self._path(path))
+          conn.sendall(b"STAT"+struct.pack("<III", st.st_mode, st.st_size, int(st.st_mtime)))
+        except OSError:
+          conn.sendall(b"STAT"+struct.pack("<III", 0, 0, 0))
+      elif id==b"RECV":
+        try:
+          with open(self._path(path), 'rb') as fp:
+            while True:
+              data = fp.read(64*1024)
+              if len(data)==0:
+                break
+              self._throttle(len(data))
+              conn.sendall(b"DATA"+struct.pack("<I", len(data))+data)
+              if self._dropped(len(data)):
+                raise EOFError()
+          conn.sendall(b"DONE"+struct.pack("<I", 0))
+        except (IOError, OSError) as ex:
+          self._syncFail(conn, str(ex))
+      elif id==b"SEND":
+        path = path.rsplit(',', 1)[0]
+        fid = self._path(path)
+        try:
+          if os.path.exists(fid):
+            os.remove(fid)  # (adbd unlinks the target first, even a block device)
+          fp = open(fid, 'wb')
+        except (IOError, OSError) as ex:
+          fp = None
+          err = str(ex)
+        while True:
+          id = self._recv(conn, 4)
+          size = struct.unpack("<I", self._recv(conn, 4))[0]
+          if id==b"DONE":
+            break
+          data = self._recv(conn, size)
+          self._throttle(size)
+          if fp:
+            fp.write(data)
+          if self._dropped(size):
+            if fp:
+              fp.close()
+            raise EOFError()
+        if fp:
+          fp.close()
+          conn.sendall(b"OKAY"+struct.pack("<I", 0))
+        else:
+          self._syncFail(conn, err)
+      else:
+        self._syncFail(conn, "unknown sync request")
+
+  def _syncFail(self, conn, msg):
+    msg = msg.encode("utf-8")
+    conn.sendall(b"FAIL"+struct.pack("<I", len(msg))+msg)
+
+
+if __name__ == "__main__":
+  port = int(sys.argv[1]) if len(sys.argv)>1 else 5037
+  dir = sys.argv[2] if len(sys.argv)>2 else "fakeMC74"
+  if not os.path.isdir(os.path.join(dir, "root")):
+    makeDevice(dir)
+  server = fakeAdbServer(dir, port)
+  print("fake MC74 "+server.serial+" in "+dir+", adb server on port "+str(server.port)
+    +"  (FAKEMC74_DIR="+os.path.abspath(dir)+" for bench/fastboot)")
+  server.serve()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+'''runBench -- Time reviveMC74's objectives end to end on a simulated MC74 (fakeMC74.py)
+
+  python bench/runBench.py [latency=0.002] [bandwidth=20000000] [rebootSecs=2] [runs=2]
+    [objectives=backupPart,fixPart,flashPart,installApps] [appSize=4000000] [dir=...]
+    [dropEvery=0] [out=bench_output.txt]
+
+  A fake phone and a fake installFiles directory are made in 'dir' (a new temporary
+  directory by default), reviveMC74 is pointed at the fake adb server and the fake
+  fastboot, and each objective is run by name (so it is really done, not skipped).  The
+  first run starts with a fresh phone and no files on this computer, later runs redo
+  the objectives on the phone as the previous run left it.  How long each objective took,
+  and where the time went (perfStats, as reviveMC74 -p shows it), are printed and
+  written to 'out' (bench_output.txt in the top reviveMC74 directory by default).
+  dropEvery=<bytes> makes the phone's USB cable drop out (for rebootSecs) after every
+  that many bytes transferred, to time resuming interrupted transfers.
+'''
+
+import sys, os, time, tempfile, shutil
+benchDir = os.path.dirname(os.path.abspath(__file__))
+topDir = os.path.dirname(benchDir)
+sys.path.insert(0, benchDir)
+sys.path.insert(0, topDir)
+import fakeMC74
+
+
+def makeInstallFiles(rv, dir, appSize):
+  '''Make stand ins for the files and apps reviveMC74 installs'''
+  os.makedirs(dir+"/extra")
+  for lst, size in [(rv.installFiles, 64*1024), (rv.installApps, appSize)]:
+    for id in lst:
+      with open(dir+"/"+lst[id][0], 'wb') as fp:
+        fp.write(os.urandom(size))
+  with open(dir+"/"+rv.neededFiles.recoveryClockImg, 'wb') as fp:
+    fp.write(os.urandom(fakeMC74.partSize))
+
+
+def benchMain(args):
+  opt = dict(latency="0.002", bandwidth="20000000", rebootSecs="2", runs="2",
+    objectives="backupPart,fixPart,flashPart,installApps", appSize="4000000", dir="",
+    dropEvery="0",
+    out=os.path.join(topDir, "bench_output.txt"))
+  for tok in args:
+    nm, val = tok.split('=', 1)
+    if nm not in opt:
+      print(__doc__)
+      return False
+    opt[nm] = val
+  out = os.path.abspath(opt["out"])
+  dir = os.path.abspath(opt["dir"] or tempfile.mkdtemp(prefix="fakeMC74"))
+  devDir, hostDir = dir+"/phone", dir+"/host"
+  for dd in [devDir, hostDir]:
+    if os.path.isdir(dd):
+      shutil.rmtree(dd)
+    os.makedirs(dd)
+
+  fakeMC74.makeDevice(devDir)
+  server = fakeMC74.fakeAdbServer(devDir, latency=float(opt["latency"]),
+    bandwidth=float(opt["bandwidth"]), rebootSecs=float(opt["rebootSecs"]),
+    dropEvery=int(opt["dropEvery"]), dropSecs=float(opt["rebootSecs"])).start()
+  os.environ.update(FAKEMC74_DIR=devDir, FAKEMC74_SERIAL=server.serial,
+    FAKEMC74_REBOOTSECS=opt["rebootSecs"], ANDROID_ADB_SERVER_PORT=str(server.port))
+  os.environ["PATH"] = benchDir+os.pathsep+os.environ["PATH"]  # (For bench/fastboot)
+
+  os.chdir(hostDir)  # (reviveMC74 works in the current directory, fileHash.cache too)
+  import reviveMC74 as rv
+  import adbClient, perfStats
+  adbClient.serverPort = server.port
+  perfStats.enabled = True
+  rv.installFilesDir = hostDir+"/installFiles"
+  makeInstallFiles(rv, rv.installFilesDir, int(opt["appSize"]))
+  rv.arg.serial = server.serial
+
+  report = ["reviveMC74 benchmark, simulated MC74: latency %ss, bandwidth %s bytes/sec, "
+    "reboot %ss, apps %s bytes%s" % (opt["latency"], opt["bandwidth"], opt["rebootSecs"],
+    opt["appSize"], ", drop out every %s bytes" % opt["dropEvery"] if int(opt["dropEvery"])
+    else ""), ""]
+  ok = True
+  for run in range(1, int(opt["runs"])+1):
+    perfStats.clear()
+    for nm in list(rv.state.keys()):
+      del rv.state[nm]
+    rv.state.update(adbMode=None, error=[], needed=[])
+    report.append("Run %d (%s):" % (run, "fresh phone" if run==1 else "phone as run %d left it"
+      % (run-1)))
+    runTm = time.time()
+    for obj in opt["objectives"].split(','):
+      rv.target = obj
+      startTm = time.time()
+      res = rv.runObjective(obj)
+      report.append("  %-16s %-6s %7.2fs" % (obj, "ok" if res else "FAILED", time.time()-startTm))
+      if not res:
+        ok = False
+        report.extend(["    --"+line for line in rv.state.error])
+        break
+    report.append("  %-16s %-6s %7.2fs" % ("total", "", time.time()-runTm))
+    report.extend(["", perfStats.summary(), ""])
+
+  adbClient.closeAll()
+  server.stop()
+  time.sleep(0.2)  # (Let its threads finish before python exits)
+  report = '\n'.join(report)
+  print('\n'+report)
+  with open(out, 'w') as fp:
+    fp.write(report+'\n')
+  print("(written to "+out+", work files in "+dir+")")
+  return ok
+
+
+if __name__ == "__main__":
+  sys.exit(0 if benchMain(sys.argv[1:]) else 1)
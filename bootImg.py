@@ -0,0 +1,551 @@
+#!/usr/bin/env python
+'''bootImg -- Read and write Android boot.img files, and the gzipped newc cpio ramdisk
+  inside them, without the unpackbootimg, mkbootimg, gzip, gunzip and cpio programs.
+
+  unpackImg() and packImg() produce/consume the same rmcBootUnpack and rmcBootRamdisk
+  directories that installFiles/packBoot.py used to make with those programs.
+
+  The Unpack directory also holds a manifest of the ramdisk's files (ramdisk.manifest)
+  and the cpio archive made from them (ramdisk.cpio), so packImg only reads the files
+  that changed, splices them into the archive, and reuses the last image it built when
+  nothing changed at all.
+
+  Edits to the ramdisk are described by a patch set, a list of bunches, one per file:
+    bunch(file="default.prop", set=[["ro.secure", "0"]], clearMode=0o022)
+    bunch(file="init.rc", insert=[["symlink /system/etc", "    symlink /a /b"]],
+      replace=[["find", "new line"]], delete=["find"])
+    bunch(file="sbin/x", add="content", mode=0o755)
+  'set' sets name=value lines (adding them if need be), 'insert' puts a line (or list of
+  lines) after the first line containing the anchor, 'replace' and 'delete' act on the
+  first (delete: every) line containing the string, 'add' makes the file, 'mode' and
+  'clearMode' set or clear its permission bits.  A patch set can be applied to the Ramdisk
+  directory (patchDir), a list of cpio entries, or a whole boot image in memory
+  (patchBootImg).  Each file is read and written once, and applying it again changes
+  nothing.
+'''
+
+import sys, os, time, struct, hashlib, zlib, shutil, json
+from ribou import *
+from datetime import datetime
+import fileHash
+
+bootMagic = b"ANDROID!"
+bootHdrFmt = "<8s10I16s512s32s1024s"  # boot_img_hdr (version 0) from mkbootimg's bootimg.h
+bootHdrSize = struct.calcsize(bootHdrFmt)
+defaultOffsets = bunch(  # mkbootimg's defaults, relative to 'base'
+  kernelOffset = 0x00008000,
+  ramdiskOffset = 0x01000000,
+  secondOffset = 0x00f00000,
+  tagsOffset = 0x00000100
+)
+cpioMagic = b"070701"  # newc format
+cpioTrailer = "TRAILER!!!"
+cpioFirstIno = 300000
+manifestFn = "ramdisk.manifest"  # (In the Unpack directory)
+cpioCacheFn = "ramdisk.cpio"
+patchEngine = 1  # (Part of patchVersion, change it if patchText's results change)
+
+
+def _str(bb):
+  '''Convert bytes read from an image to a native str (no-op in python 2)'''
+  return bb if str==bytes else bb.decode("utf-8", "replace")
+
+
+def _bytes(ss):
+  return ss if type(ss)==bytes else ss.encode("utf-8")
+
+
+def _pad(size, align):
+  return (align - size%align) % align
+
+
+def readBootImg(data):
+  '''Parse the boot.img header and split out the kernel, ramdisk and second stage
+  images.  Returns a bunch, or None if data is not an Android boot image.
+  '''
+  if len(data)<bootHdrSize or data[:8]!=bootMagic:
+    return None
+  hdr = struct.unpack(bootHdrFmt, data[:bootHdrSize])
+  magic, kSize, kAddr, rSize, rAddr, sSize, sAddr, tAddr, pageSize, hdrVer, osVer, \
+    name, cmdline, id, extraCmdline = hdr
+  base = kAddr - defaultOffsets.kernelOffset
+  bi = bunch(
+    pageSize = pageSize,
+    base = base,
+    kernelOffset = kAddr-base,
+    ramdiskOffset = rAddr-base,
+    secondOffset = sAddr-base,
+    tagsOffset = tAddr-base,
+    board = _str(name.split(b'\0')[0]),
+    cmdline = _str(cmdline.split(b'\0')[0]+extraCmdline.split(b'\0')[0]),
+  )
+  pos = pageSize  # The header occupies the first page
+  bi.kernel = data[pos:pos+kSize];  pos += kSize+_pad(kSize, pageSize)
+  bi.ramdisk = data[pos:pos+rSize];  pos += rSize+_pad(rSize, pageSize)
+  bi.second = data[pos:pos+sSize]
+  return bi
+
+
+def writeBootImg(bi):
+  '''Build a boot.img (as bytes) from a bunch like the one readBootImg returns, the
+  same way mkbootimg does
+  '''
+  pageSize = int(bi.pageSize)
+  cmdline = _bytes(bi.get("cmdline", ""))
+  sha = hashlib.sha1()
+  for part in [bi.kernel, bi.ramdisk, bi.get("second", b"")]:
+    sha.update(part)
+    sha.update(struct.pack("<I", len(part)))
+
+  def addr(offNm):
+    return (bi.base+bi.get(offNm, defaultOffsets[offNm])) & 0xffffffff
+
+  hdr = struct.pack(bootHdrFmt, bootMagic,
+    len(bi.kernel), addr("kernelOffset"), len(bi.ramdisk), addr("ramdiskOffset"),
+    len(bi.get("second", b"")), addr("secondOffset"), addr("tagsOffset"), pageSize, 0, 0,
+    _bytes(bi.get("board", ""))[:15], cmdline[:511], sha.digest(), cmdline[511:][:1023])
+  img = [hdr, b'\0'*_pad(len(hdr), pageSize)]
+  for part in [bi.kernel, bi.ramdisk, bi.get("second", b"")]:
+    img.append(part)
+    img.append(b'\0'*_pad(len(part), pageSize))
+  return b''.join(img)
+
+
+def gunzipData(data):
+  '''Decompress a gzip'ed buffer in memory'''
+  return zlib.decompressobj(16+zlib.MAX_WBITS).decompress(data)
+
+
+def gzipData(data, level=6):
+  '''gzip a buffer in memory.  (The gzip header has a zero timestamp, so the same
+  input always produces the same output.)
+  '''
+  zz = zlib.compressobj(level, zlib.DEFLATED, 16+zlib.MAX_WBITS)
+  return zz.compress(data)+zz.flush()
+
+
+def readCpio(data):
+  '''Parse a newc cpio archive, returns a list of bunches (name, mode, mtime, data ...)
+  for each entry, not including the trailer
+  '''
+  entries = []
+  pos = 0
+  while pos+110<=len(data):
+    if data[pos:pos+6]!=cpioMagic:
+      raise ValueError("bad cpio header at offset %d" % pos)
+    fld = [int(data[pos+6+ii*8:pos+14+ii*8], 16) for ii in range(0, 13)]
+    ino, mode, uid, gid, nlink, mtime, fSize, devMaj, devMin, rdevMaj, rdevMin, nmSize, \
+      check = fld
+    pos += 110
+    name = _str(data[pos:pos+nmSize-1])
+    pos += nmSize+_pad(110+nmSize, 4)
+    body = data[pos:pos+fSize]
+    pos += fSize+_pad(fSize, 4)
+    if name==cpioTrailer:
+      break
+    entries.append(bunch(name=name, mode=mode, uid=uid, gid=gid, nlink=nlink, mtime=mtime,
+      ino=ino, rdevMaj=rdevMaj, rdevMin=rdevMin, data=body))
+  return entries
+
+
+def writeCpio(entries):
+  '''Build a newc cpio archive (bytes) from a list of entry bunches, like readCpio
+  returns.  Inode numbers are assigned sequentially.
+  '''
+  return joinCpio([cpioRecord(cpioFirstIno+ii, ent) for ii, ent in enumerate(entries)])
+
+
+def cpioRecord(ino, ent):
+  '''Return the header, name and data of one cpio entry.  Its length is a multiple of 4,
+  so records can be cut out of one archive and spliced into another.
+  '''
+  name = _bytes(ent.name)+b'\0'
+  body = ent.get("data", b"")
+  hdr = cpioMagic+b''.join([("%08X" % vv).encode("ascii") for vv in [ino,
+    ent.get("mode", 0), ent.get("uid", 0), ent.get("gid", 0), ent.get("nlink", 1),
+    ent.get("mtime", 0), len(body), 0, 0, ent.get("rdevMaj", 0), ent.get("rdevMin", 0),
+    len(name), 0]])
+  return b''.join([hdr+name, b'\0'*_pad(len(hdr)+len(name), 4), body,
+    b'\0'*_pad(len(body), 4)])
+
+
+def joinCpio(records):
+  '''Make an archive of cpio records, adding the trailer'''
+  records = records+[cpioRecord(0, bunch(name=cpioTrailer))]
+  size = sum([len(rec) for rec in records])
+  return b''.join(records)+b'\0'*_pad(size, 512)  # cpio pads the archive to a 512 byte block
+
+
+def extractCpio(entries, dir):
+  '''Write cpio entries out as files in 'dir', preserving modes and modification times
+  (like 'cpio -i -m')
+  '''
+  dirs = []
+  for ent in entries:
+    fid = os.path.join(dir, ent.name)
+    typ = ent.mode & 0o170000
+    if typ==0o040000:  # Directory
+      if os.path.isdir(fid)==False:
+        os.makedirs(fid)
+      dirs.append(ent)
+      continue
+    pDir = os.path.dirname(fid)
+    if pDir and os.path.isdir(pDir)==False:
+      os.makedirs(pDir)
+    if typ==0o120000 and hasattr(os, "symlink"):  # Symbolic link, data is the target
+      os.symlink(_str(ent.data), fid)
+      continue
+    if typ not in [0o100000, 0o120000]:
+      print("  (skipping special file "+ent.name+", mode "+oct(ent.mode)+")")
+      continue
+    with open(fid, 'wb') as ff:
+      ff.write(ent.data)
+    _setModeTime(fid, ent)
+  for ent in reversed(dirs):  # Do directories last, writing files changes their mtime
+    _setModeTime(os.path.join(dir, ent.name), ent)
+
+
+def _setModeTime(fid, ent):
+  try:
+    os.chmod(fid, ent.mode & 0o7777)
+    os.utime(fid, (ent.mtime, ent.mtime))
+  except OSError:
+    pass  # (Windows can't set all the mode bits)
+
+
+def cpioFromDir(dir):
+  '''Make a list of cpio entries from all the files under 'dir', sorted by name,
+  with owner root.root (like 'find . | sort | cpio -o -H newc -R 0.0')
+  '''
+  entries = []
+  for fn in sorted([ff[len(dir)+1:] for ff in listDir(dir)]):
+    fid = os.path.join(dir, fn)
+    st = os.lstat(fid)
+    ent = bunch(name=fn.replace('\\', '/'), mode=st.st_mode, mtime=int(st.st_mtime),
+      nlink=2 if os.path.isdir(fid) else 1, data=b"")
+    if os.path.islink(fid):
+      ent.data = _bytes(os.readlink(fid))
+    elif os.path.isfile(fid):
+      ent.data = readFile(fid, ascii=False)
+    entries.append(ent)
+  return entries
+
+
+def readManifest(unDir):
+  try:
+    with open(unDir+'/'+manifestFn) as fp:
+      return json.load(fp)
+  except (IOError, ValueError):
+    return {}
+
+
+def writeManifest(unDir, man):
+  with open(unDir+'/'+manifestFn, 'w') as fp:
+    json.dump(man, fp)
+
+
+def ramdiskCpio(unDir, rdDir):
+  '''Return the cpio archive of the files under rdDir, the same as
+  writeCpio(cpioFromDir(rdDir)), and how many entries changed since the last call.
+  The archive is kept in unDir, with a manifest of its entries ([name, mode, mtime, nlink,
+  size, md5, offset, length]).  Files whose mode, mtime and size are unchanged are not
+  read, their records are copied from the old archive.
+  '''
+  man = readManifest(unDir)
+  old = {}
+  cache = b""
+  if man and os.path.isfile(unDir+'/'+cpioCacheFn):
+    cache = readFile(unDir+'/'+cpioCacheFn, ascii=False)
+    if fileHash.md5Data(cache)==man.get("cpio"):
+      old = dict([(ent[0], ent) for ent in man["entries"]])
+  scanTm = int(time.time())
+
+  records, entries, changed, pos = [], [], 0, 0
+  for ii, fn in enumerate(sorted([ff[len(rdDir)+1:] for ff in listDir(rdDir)])):
+    fid = os.path.join(rdDir, fn)
+    st = os.lstat(fid)
+    ent = [fn.replace('\\', '/'), st.st_mode, int(st.st_mtime),
+      2 if os.path.isdir(fid) else 1, st.st_size]
+    ino = ("%08X" % (cpioFirstIno+ii)).encode("ascii")
+    prev = old.get(ent[0])
+    # (A file changed in the same second as the last scan may have been changed after it)
+    if prev and prev[:5]==ent and prev[2]<man["time"]:
+      rec = cache[prev[6]:prev[6]+prev[7]]
+      if rec[6:14]!=ino:  # Entries were added or removed before this one
+        rec = rec[:6]+ino+rec[14:]
+      ent.append(prev[5])
+    else:
+      data = b""
+      if os.path.islink(fid):
+        data = _bytes(os.readlink(fid))
+      elif os.path.isfile(fid):
+        data = readFile(fid, ascii=False)
+      rec = cpioRecord(cpioFirstIno+ii, bunch(name=ent[0], mode=ent[1], mtime=ent[2],
+        nlink=ent[3], data=data))
+      ent.append(fileHash.md5Data(data))
+      if prev==None or prev[:6]!=ent:
+        changed += 1
+    ent.extend([pos, len(rec)])
+    pos += len(rec)
+    records.append(rec)
+    entries.append(ent)
+  changed += len(set(old)-set([ent[0] for ent in entries]))  # (Deleted files)
+
+  rd = joinCpio(records)
+  man.update(time=scanTm, cpio=fileHash.md5Data(rd), entries=entries)
+  if changed or len(cache)!=len(rd):
+    writeBin(unDir+'/'+cpioCacheFn, rd)
+  writeManifest(unDir, man)
+  return rd, changed
+
+
+def listDir(dir, recursive=True):
+  # Replacement for 'find . -print' on Windows
+  lst = []
+  for fn in os.listdir(dir):
+    subdir = dir+'/'+fn
+    lst.append(subdir)
+    if recursive and os.path.isdir(subdir) and not os.path.islink(subdir):
+      lst.extend(listDir(subdir))
+  return lst
+
+
+def imgDirs(biFn):
+  '''Return the names of the Unpack and Ramdisk directories for a boot image file,
+  ie rmcBoot.imgRaw -> rmcBootUnpack, rmcBootRamdisk
+  '''
+  dir, fn = os.path.split(biFn)
+  fn = os.path.join(dir, fn.split('.')[0])
+  return fn+"Unpack", fn+"Ramdisk"
+
+
+def unpackImg(biFn):
+  '''Unpack a boot image file into the <fn>Unpack directory (kernel, ramdisk, and the
+  mkbootimg parameters) and expand the ramdisk into the <fn>Ramdisk directory.
+  Returns False if biFn is not a boot image.
+  '''
+  unDir, rdDir = imgDirs(biFn)
+  bi = readBootImg(readFile(biFn, ascii=False))
+  if bi==None:
+    print("  ("+biFn+" is not a boot partition image.)")
+    return False
+
+  img = readManifest(unDir).get("image")  # (Keyed by content, so still good)
+  for dir in [unDir, rdDir]:
+    if os.path.isdir(dir):
+      shutil.rmtree(dir)
+    os.mkdir(dir)
+
+  params = bunch(cmdline=bi.cmdline, board=bi.board, base="%08x" % bi.base,
+    pagesize=str(bi.pageSize), kernel_offset="%08x" % bi.kernelOffset,
+    ramdisk_offset="%08x" % bi.ramdiskOffset, second_offset="%08x" % bi.secondOffset,
+    tags_offset="%08x" % bi.tagsOffset)
+  for nm in params:
+    writeFile(unDir+'/'+nm, params[nm]+'\n')
+  writeBin(unDir+"/zImage", bi.kernel)
+  if len(bi.second)>0:
+    writeBin(unDir+"/second", bi.second)
+
+  rd = gunzipData(bi.ramdisk)
+  writeBin(unDir+"/ramdisk", rd)
+  entries = readCpio(rd)
+  extractCpio(entries, rdDir)
+  ramdiskCpio(unDir, rdDir)  # Make the manifest, for packImg
+  if img:
+    writeManifest(unDir, dict(readManifest(unDir), image=img))
+  print("  unpacked "+biFn+": kernel "+str(len(bi.kernel))+", ramdisk "+str(len(rd))
+    +" bytes, "+str(len(entries))+" files")
+  return True
+
+
+def packImg(biFn, outFid=None):
+  '''Pack the <fn>Ramdisk directory back into a ramdisk, and build a boot image from it
+  and the kernel and parameters in the <fn>Unpack directory.  The image is written to
+  outFid, by default <biFn><yymmddHHMM>.  Returns the name of the image file.
+  If the ramdisk, kernel and parameters are the same as when packImg last ran, the image
+  it made then is reused.
+  '''
+  unDir, rdDir = imgDirs(biFn)
+  if outFid==None:
+    outFid = biFn+datetime.now().strftime("%y%m%d%H%M")
+
+  def param(nm, default=None):
+    fid = unDir+'/'+nm
+    if os.path.isfile(fid)==False:
+      return default
+    return readFile(fid).rstrip("\r\n")
+
+  rd, changed = ramdiskCpio(unDir, rdDir)
+  man = readManifest(unDir)
+  if man.get("gz")!=man["cpio"] or os.path.isfile(unDir+"/ramdisk.gz")==False:
+    writeBin(unDir+"/ramdisk.gz", gzipData(rd))
+    man["gz"] = man["cpio"]  # (What ramdisk.gz was made from)
+  if os.path.isfile(unDir+"/ramdisk"):
+    os.remove(unDir+"/ramdisk")  # (like gzip does)
+
+  key = [man["cpio"], fileHash.md5File(unDir+"/zImage")]
+  if os.path.isfile(unDir+"/second"):
+    key.append(fileHash.md5File(unDir+"/second"))
+  key = fileHash.md5Data(_bytes(' '.join(key+[str(param(nm)) for nm in ["cmdline", "board",
+    "base", "pagesize", "kernel_offset", "ramdisk_offset", "second_offset", "tags_offset"]])))
+  img = man.get("image", {})
+  if img.get("key")==key and os.path.isfile(img["fid"]) and \
+      fileHash.md5File(img["fid"])==img["md5"]:
+    if os.path.abspath(outFid)!=img["fid"]:
+      shutil.copy(img["fid"], outFid)
+    writeManifest(unDir, man)
+    print("  "+outFid+": unchanged, reusing "+img["fid"])
+    return outFid
+
+  bi = bunch(kernel=readFile(unDir+"/zImage", ascii=False), ramdisk=readFile(unDir
+    +"/ramdisk.gz", ascii=False), cmdline=param("cmdline", ""), board=param("board", ""),
+    base=int(param("base"), 16), pageSize=int(param("pagesize")))
+  if os.path.isfile(unDir+"/second"):
+    bi.second = readFile(unDir+"/second", ascii=False)
+  for nm, offNm in [["kernel_offset", "kernelOffset"], ["ramdisk_offset", "ramdiskOffset"],
+      ["second_offset", "secondOffset"], ["tags_offset", "tagsOffset"]]:
+    if param(nm):
+      bi[offNm] = int(param(nm), 16)
+
+  data = writeBootImg(bi)
+  writeBin(outFid, data)
+  fileHash.remember(outFid, fileHash.md5Data(data))
+  man["image"] = dict(key=key, fid=os.path.abspath(outFid), md5=fileHash.md5Data(data))
+  writeManifest(unDir, man)
+  print("  packed "+outFid+": ramdisk "+str(len(rd))+" bytes, "+str(changed)
+    +" entries changed")
+  return outFid
+
+
+def patchVersion(patches):
+  '''Return a short hash of a patch set, it changes if any edit in it does'''
+  return fileHash.md5Data(_bytes(str(patchEngine)+json.dumps(patches, sort_keys=True)))[:12]
+
+
+def patchText(text, patch):
+  '''Apply one file's edits (set, replace, delete, insert) to its text.  Returns the new
+  text and a list of the edits that could not be made.
+  '''
+  lines = [ln[:-1] if ln[-1:]=='\r' else ln for ln in text.split('\n')]
+  missing = []
+  def find(ss):
+    for ii in range(0, len(lines)):
+      if ss in lines[ii]:
+        return ii
+    return None
+
+  for nm, val in patch.get("set", []):
+    found = [ii for ii in range(0, len(lines)) if lines[ii].split('=', 1)[0].strip()==nm]
+    if found:
+      lines[found[0]] = nm+'='+val
+    else:  # (Before the empty 'line' after the last \n)
+      lines.insert(len(lines)-1 if lines[-1]=="" else len(lines), nm+'='+val)
+  for ss, new in patch.get("replace", []):
+    ii = find(ss)
+    if ii!=None:
+      lines[ii] = new
+    elif new not in lines:  # (Not already replaced)
+      missing.append(patch.file+": can't find '"+ss+"' to replace")
+  for ss in patch.get("delete", []):
+    lines = [ln for ln in lines if ss not in ln]
+  for anchor, new in patch.get("insert", []):
+    new = [new] if type(new)==str else list(new)
+    ii = find(anchor)
+    if ii==None:
+      missing.append(patch.file+": can't find '"+anchor+"' to insert after")
+    elif lines[ii+1:ii+1+len(new)]!=new:  # (Not already inserted)
+      lines[ii+1:ii+1] = new
+  return '\n'.join(lines), missing
+
+
+def patchData(patches, data, mode):
+  '''Apply a file's patches to its content (None if there is no such file) and mode.
+  Returns the new content and mode, and the edits that could not be made.
+  '''
+  missing = []
+  for patch in patches:
+    if "add" in patch:
+      data, mode = _bytes(patch.add), 0o100644
+    elif data==None:
+      missing.append(patch.file+": not found")
+      continue
+    if [nm for nm in ["set", "replace", "delete", "insert"] if nm in patch]:
+      text = data if str==bytes else data.decode("utf-8", "surrogateescape")
+      text, miss = patchText(text, patch)
+      data = text if str==bytes else text.encode("utf-8", "surrogateescape")
+      missing.extend(miss)
+    if "mode" in patch:
+      mode = (mode & ~0o7777) | patch.mode
+    mode &= ~patch.get("clearMode", 0)
+  return data, mode, missing
+
+
+def _byFile(patches):
+  '''Group a patch set by file, in the order the files first appear'''
+  files = []
+  for patch in patches:
+    if patch.file not in files:
+      files.append(patch.file)
+  return [(fn, [patch for patch in patches if patch.file==fn]) for fn in files]
+
+
+def patchDir(dir, patches):
+  '''Apply a patch set to the files under 'dir' (ie rmcBootRamdisk).  Files are only
+  written if they change.  Returns a list of the edits that could not be made.
+  '''
+  missing = []
+  for fn, group in _byFile(patches):
+    fid = os.path.join(dir, fn)
+    data, mode = None, 0
+    if os.path.isfile(fid):
+      data, mode = readFile(fid, ascii=False), os.stat(fid).st_mode
+    new, newMode, miss = patchData(group, data, mode)
+    missing.extend(miss)
+    if new==None:
+      continue
+    if new!=data:
+      if os.path.isdir(os.path.dirname(fid))==False:
+        os.makedirs(os.path.dirname(fid))
+      writeBin(fid, new)
+    if newMode!=mode:
+      os.chmod(fid, newMode & 0o7777)
+  return missing
+
+
+def patchEntries(entries, patches):
+  '''Apply a patch set to a list of cpio entries (as readCpio returns), in place.
+  Returns a list of the edits that could not be made.
+  '''
+  missing = []
+  byName = dict([(ent.name, ent) for ent in entries])
+  for fn, group in _byFile(patches):
+    ent = byName.get(fn)
+    data, mode = (ent.data, ent.mode) if ent else (None, 0)
+    new, newMode, miss = patchData(group, data, mode)
+    missing.extend(miss)
+    if new==None or (new==data and newMode==mode):
+      continue
+    if ent==None:
+      ent = bunch(name=fn, nlink=1)
+      entries.append(ent)
+      entries.sort(key=lambda ent: ent.name)
+    ent.update(data=new, mode=newMode, mtime=int(time.time()))
+  return missing
+
+
+def patchBootImg(data, patches):
+  '''Apply a patch set to the ramdisk of a boot image, without unpacking it to disk.
+  Returns the new image and a list of the edits that could not be made.
+  '''
+  bi = readBootImg(data)
+  if bi==None:
+    raise ValueError("not a boot image")
+  entries = readCpio(gunzipData(bi.ramdisk))
+  missing = patchEntries(entries, patches)
+  bi.ramdisk = gzipData(writeCpio(entries))
+  return writeBootImg(bi), missing
+
+
+def writeBin(fid, data):
+  with open(fid, 'wb') as ff:
+    ff.write(data)
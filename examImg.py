@@ -3,10 +3,15 @@
   its form and files.
 '''
 
-import sys, os, time, datetime, shutil, inspect
+import sys, os, time, datetime, shutil, inspect, threading, re, random, io, socket, json, atexit
 from ribou import *
+import ribou, bootImg, fileHash, adbClient, perfStats
 
 logFid = "reviveMC74.log"
+logMaxSize = 10*1024*1024  # When the log gets this big it is renamed to .1 (.1 to .2, etc)
+logKeep = 3  # Number of old logs kept
+logCtx = threading.local()  # logCtx.objective is recorded with each log entry
+workRoot = os.getcwd()  # The top of the device workspaces, see workspace()
 
 def examImg(args):
   # If no args, display comaparison of all img* directories
@@ -27,22 +32,18 @@ def examImg(args):
     shutil.rmtree(imgDir)
   os.mkdir(imgDir)
   shutil.copyfile(imgFn, imgDir+'/'+imgFn)
-  os.chdir(os.getcwd()+'/'+imgDir)
 
-  resp, rc = execute(sys.executable+' '+pyFileDir+"/installFiles/packBoot.py unpack "+imgFn)
-  #print("unpack: %d -- %s" % (rc, resp))
+  bootImg.unpackImg(imgDir+'/'+imgFn)
 
-  print(fileInfo('', imgFn))
+  print(fileInfo(imgDir+'/', imgFn))
 
   print(imgDir+" -- ramdisk:")
-  for fn in os.listdir("./rmcBootRamdisk"):
-    print(fileInfo("./rmcBootRamdisk/", fn))
+  for fn in os.listdir(imgDir+"/rmcBootRamdisk"):
+    print(fileInfo(imgDir+"/rmcBootRamdisk/", fn))
 
   print(imgDir+" -- unpack:")
-  for fn in os.listdir("./rmcBootUnpack"):
-    print(fileInfo("./rmcBootUnpack/", fn))
-
-  os.chdir('..')  # Go back from imgDir to the original directory
+  for fn in os.listdir(imgDir+"/rmcBootUnpack"):
+    print(fileInfo(imgDir+"/rmcBootUnpack/", fn))
 
 
 def compareImg(args):
@@ -115,17 +116,15 @@ def fileSig(group, fn, iInf, ref):
 
 def analyzeDir(dir):
   inf = bunch(img=bunch(fn=dir), unpack=bunch(), ramdisk=bunch())
-  os.chdir(dir)  # Enter the directory with the files
-  inf.img = fInfo('', "rmcBoot."+dir)
+  fileHash.md5Tree(dir)  # Hash all the files at once, on several threads, for fInfo
+  inf.img = fInfo(dir+'/', "rmcBoot."+dir)
   inf.img.name = dir
 
-  for fn in os.listdir("./rmcBootRamdisk"):
-    inf.ramdisk[fn] = fInfo("./rmcBootRamdisk/", fn)
-
-  for fn in os.listdir("./rmcBootUnpack"):
-    inf.unpack[fn] = fInfo("./rmcBootUnpack/", fn)
+  for fn in os.listdir(dir+"/rmcBootRamdisk"):
+    inf.ramdisk[fn] = fInfo(dir+"/rmcBootRamdisk/", fn)
 
-  os.chdir('..')  # Go back from imgDir to the original directory
+  for fn in os.listdir(dir+"/rmcBootUnpack"):
+    inf.unpack[fn] = fInfo(dir+"/rmcBootUnpack/", fn)
   return inf
 
 
@@ -143,14 +142,13 @@ def fInfo(dir, fn):
   if sz<80 and os.path.isfile(dir+fn): finf.cont = readFile(dir+fn)
 
   if os.path.isfile(dir+fn):
-    md5, rc = execute('md5 '+dir+fn)
-    finf.md5 = md5.split()[0]
+    finf.md5 = fileHash.md5File(dir+fn)
   return finf
 
 
 def fileInfo(dir, fn):
   if os.path.isfile(dir+fn):
-    md5, rc = execute('md5 '+dir+fn)
+    md5 = fileHash.md5File(dir+fn)
   else:
     md5 = "        "
   resp = "  "+md5[0:4]+" "+md5[4:8]+" "+str(os.path.getsize(dir+fn)).rjust(8)
@@ -165,8 +163,7 @@ def pack(args):
   if ii==0:  imgFn = 'rmcBoot'+imgFn
   print("Pack this dir into %s" % (imgFn))
 
-  resp, rc = execute(sys.executable+' '+pyFileDir+'/installFiles/packBoot.py pack '+imgFn)
-  print("%d %s" % (rc, resp))
+  bootImg.packImg(imgFn)
 
 
 def tc(vv):
@@ -175,66 +172,349 @@ def tc(vv):
 
 
 # Utilities used by reviveMC74.py
+class threadBunch(object):
+  '''A bunch whose contents can be swapped out, per thread, with bind().  Threads that
+    have not bound their own bunch see the default one, so single device runs behave
+    just like a plain global bunch.  (Used for reviveMC74's 'state' and 'arg' so each
+    device in a fleet run gets its own.)
+  '''
+  def __init__(self, **kwds):
+    object.__setattr__(self, '_default', bunch(**kwds))
+    object.__setattr__(self, '_local', threading.local())
+
+  def bind(self, bn=None):
+    '''Make 'bn' this thread's bunch, bind() with no bunch reverts to the default'''
+    self._local.bn = bn
+
+  def current(self):
+    bn = getattr(self._local, 'bn', None)
+    return self._default if bn is None else bn
+
+  def __getattr__(self, nm):
+    try:
+      return self.current()[nm]
+    except KeyError:
+      raise AttributeError(nm)
+
+  def __setattr__(self, nm, val):  self.current()[nm] = val
+  def __delattr__(self, nm):  del self.current()[nm]
+  def __getitem__(self, nm):  return self.current()[nm]
+  def __setitem__(self, nm, val):  self.current()[nm] = val
+  def __delitem__(self, nm):  del self.current()[nm]
+  def __contains__(self, nm):  return nm in self.current()
+  def __iter__(self):  return iter(self.current())
+  def __len__(self):  return len(self.current())
+  def __repr__(self):  return repr(self.current())
+  def get(self, nm, default=None):  return self.current().get(nm, default)
+  def keys(self):  return self.current().keys()
+  def items(self):  return self.current().items()
+  def update(self, *args, **kwds):  self.current().update(*args, **kwds)
+
+
+def devSerial():
+  '''Return the adb serial of the device we are talking to ('host:port' for a TCP
+    connected device), or "" if none was selected (ie there is only one device)
+  '''
+  if 'arg' not in sys.__dict__:
+    return ""
+  if "host" in sys.arg:
+    host = sys.arg.host  # Was an explicity host device specified?
+    if host.find(':') == -1:
+      host += ":5555"
+    return host
+  return sys.arg.get("serial", "")
+
+
+def workspace(fn="", serial=None):
+  '''Return the path of 'fn' in a device's workspace, the directory its files (rmcBoot.img,
+  rmcBoot.imgRaw, rmcBootRamdisk, version.info ...) are kept in.  That is the directory
+  reviveMC74 was started in, or, for a device picked by serial number (serial=, or in a
+  fleet run) or a network device (host=), rmcWork/<serial> in it (rmcWork/<host>_<port>
+  for a network device), so several devices can be worked on at once.
+  (Nothing changes the current directory, paths are made with this instead.)
+  '''
+  serial = serial or devSerial()
+  dir = os.path.join(workRoot, "rmcWork", serial.replace(':', '_')) if serial else workRoot
+  if os.path.isdir(dir)==False:
+    try:
+      os.makedirs(dir)
+    except OSError:
+      pass  # (Another thread just made it)
+  return os.path.join(dir, fn) if fn else dir
+
+
+def listDevices():
+  '''Return a list of [serial, mode] for every device shown by 'adb devices' and
+    'fastboot devices'.  Devices fastboot can't open (no permissions) are skipped.
+  '''
+  devs = []
+  for cmd in ["adb devices", "fastboot devices"]:
+    try:
+      resp, rc = execute(cmd)
+    except Exception as ex:
+      logp("    (can't run '"+cmd+"': "+str(ex)+")")
+      continue
+    for ln in linesToList(resp):
+      tok = ln.split('\t')
+      if len(tok)!=2 or tok[0].find("no permissions")!=-1:
+        continue  # 'List of devices attached' header, or a device we can't use
+      if tok[1] in ["device", "recovery", "fastboot"]:
+        devs.append([tok[0], tok[1]])
+      else:
+        logp("    (ignoring "+tok[0]+", state '"+tok[1]+"')")
+  return devs
+
+
+def findDevLine(data, searchStr):
+  '''Like findLine, for the output of 'adb devices' or 'fastboot devices', but if
+    a device serial was selected, only that device's line will match
+  '''
+  serial = devSerial()
+  for line in data.split('\n'):
+    if searchStr in line and (serial=="" or line.split('\t')[0]==serial):
+      return line
+
+
+class devTracker(object):
+  '''Keeps the state of the attached devices, 'device', 'recovery', 'offline', etc
+    as the adb server reports them (on a background thread, from the adb server's
+    track-devices stream) or 'fastboot' from 'fastboot devices'.  Use deviceTracker()
+    to get the (started) tracker, then state() to see what a device is doing, or wait()
+    for it to get to the state that is needed, rather than polling.
+  '''
+  probeInterval = 1.0  # Seconds between 'fastboot devices' (or 'adb devices') probes
+
+  def __init__(self):
+    self.adbStates = {}  # {serial: state} of devices adb sees
+    self.fbStates = {}  # {serial: 'fastboot'}
+    self.fbTime = 0  # When 'fastboot devices' was last run
+    self.ready = False  # Set when we have the first list from adb
+    self.cond = threading.Condition()  # Guards the states (never held while probing)
+    self.probeLock = threading.Lock()  # Guards fbTime
+
+  def start(self):
+    th = threading.Thread(target=self._adbLoop)
+    th.daemon = True
+    th.start()
+
+  def _adbLoop(self):
+    startedServer = False
+    while True:
+      try:
+        if adbClient.enabled:
+          for devs in adbClient.trackDevices():
+            self._update("adb", dict(devs))
+      except socket.error:
+        if not startedServer:  # The adb program starts the server, then we'll track it
+          startedServer = True
+          try:
+            execute("adb start-server", False)
+            continue
+          except OSError:
+            pass  # (No adb program)
+      except adbClient.adbError:
+        pass
+      # No adb server to follow (or reviveMC74 -a), poll with the adb program instead
+      self._update("adb", self._probe("adb devices"))
+      time.sleep(self.probeInterval)
+
+  def _probe(self, cmd):
+    try:
+      resp, rc = execute(cmd, False)
+    except Exception:
+      return {}  # (No fastboot program?)
+    states = {}
+    for ln in linesToList(resp):
+      tok = ln.split('\t')
+      if len(tok)==2 and tok[0].find("no permissions")==-1:
+        states[tok[0]] = tok[1]
+    return states
+
+  def _probeFastboot(self):
+    '''Run 'fastboot devices' (if it wasn't just run) and merge what it finds.  Called
+    without self.cond held, so nobody waits on the lock while the program runs.
+    '''
+    with self.probeLock:
+      if time.time()-self.fbTime < self.probeInterval:
+        return  # (Just done, or another thread is doing it)
+      self.fbTime = time.time()
+    self._update("fastboot", self._probe("fastboot devices"))
+
+  def _update(self, kind, states):
+    with self.cond:
+      old = self.adbStates if kind=="adb" else self.fbStates
+      for serial in set(old.keys()) | set(states.keys()):
+        if old.get(serial)!=states.get(serial):
+          log("    (device "+serial+": "+str(old.get(serial, "gone"))+" -> "
+            +str(states.get(serial, "gone"))+", from "+kind+")")
+      if kind=="adb":
+        self.adbStates = states
+        self.ready = True
+      else:
+        self.fbStates = states
+      self.cond.notify_all()
+
+  def _state(self, serial):
+    for states in [self.adbStates, self.fbStates]:  # (A device adb sees isn't in fastboot)
+      for sn, st in states.items():
+        if serial=="" or sn==serial:
+          return [sn, st]
+    return [serial, None]
+
+  def state(self, serial=""):
+    '''Return [serial, state] of the device ('fastboot' if it is in fastboot mode), or
+    [serial, None] if it isn't attached.  If no serial is given, any device will do.
+    '''
+    with self.cond:
+      end = time.time()+5
+      while not self.ready and time.time()<end:  # Wait for adb's first list
+        self.cond.wait(0.5)
+      dev = self._state(serial)
+    if dev[1]==None:
+      self._probeFastboot()
+      with self.cond:
+        dev = self._state(serial)
+    return dev
+
+  def wait(self, states, timeout, serial=""):
+    '''Wait up to 'timeout' seconds for the device to be in one of 'states' (ie
+    ['recovery'] or ['fastboot']).  Returns its [serial, state], or None if it timed out.
+    '''
+    startTm = time.time()
+    end = startTm+timeout
+    while True:
+      with self.cond:
+        dev = self._state(serial)
+        if dev[1] in states:
+          break
+        if time.time()>=end or (serial and serial in adbClient.cancelled):
+          dev = None
+          break
+      if "fastboot" in states or dev[1]==None:
+        self._probeFastboot()  # (adb events wake us, fastboot must be asked)
+      with self.cond:
+        dev = self._state(serial)  # (Checked again, so a change made meanwhile isn't missed)
+        if dev[1] in states:
+          break
+        self.cond.wait(min(self.probeInterval, max(end-time.time(), 0.01)))
+    profile("wait", "for "+'/'.join(states), time.time()-startTm)
+    return dev
+
+
+_tracker = None
+_trackerLock = threading.Lock()
+
+def deviceTracker():
+  '''Return the devTracker, starting it the first time'''
+  global _tracker
+  with _trackerLock:
+    if _tracker==None:
+      _tracker = devTracker()
+      _tracker.start()
+  return _tracker
+
+
 def editFile(fid, find="<editMe>", replace=None, insert=None, delete=None, adb=False):
   '''Simple edit of a file.  Find first line containing 'find' string, then 'insert' a line
     lines, and/or 'replace' the line we found, or delete the line found, then write back to
     disk.  
 
-    By default, the file is on this computer's file system, if adb=True, the file is read
-    and written (pulled and pushed) to the remove Android device using adb.
+    By default, the file is on this computer's file system, if adb=True, the file is on
+    the Android device, see editRemote (which can also make many edits to many files at
+    once).
   '''
+  if adb:
+    return editRemote([bunch(fid=fid, find=find, replace=replace, insert=insert,
+      delete=delete)])
   logp("  -- editFile "+fid+" find '"+find+"'")
   try:
-    if adb:
-      localTmpFid = "examImgEditFile.tmp"
-      resp, rc = executeAdbLog("pull "+fid+" "+localTmpFid)
-      body = readFile(localTmpFid)
-    else:
-      body = readFile(fid)
-    
-    lines = body.split('\n')
-    pp = []
-    for lnNo in range(0, len(lines)):
-      ln = lines[lnNo]  # Get lines by index number so we can inspect/insert/delete future lines
-      if ln[-1:]=='\r':  ln = ln[:-1]  # Remove \r from \r\n on windows systems
-      if find and ln.find(find)!=-1:  # Does this line contain the content we need to find?
-        find = None  # Remove the 'find' string now that we found it
-        if replace:  # If the line is to be replaced, replace it, otherwise add it
-          pp.append(replace)
-        elif not delete:
-          pp.append(ln)  # Keep this line, others may be inserted next
-        
-        if insert:  # Insert a list of lines, or just one line
-          # Avoid creating duplicate inserts if fixPart is run multiple times
-          firstInsert = insert if type(insert)==str else insert[0]
-          print("    firstInsert '"+firstInsert+"'")
-          print("    next line   '"+lines[lnNo+1]+"' ("+str(len(lines)>lnNo+1)
-            +" "+str(len(lines)>lnNo+1 and lines[lnNo+1]!=firstInsert)+")")
-          if len(lines)>lnNo+1 and lines[lnNo+1]!=firstInsert:
-            if type(insert)==list:
-              for il in insert:
-                pp.append(il)
-            else:
-              pp.append(insert)
-          else:
-            logp("  (ignoring duplicate insertion edit request for: '"+firstInsert+"'")
-      else:
-        pp.append(ln)  # This is not the line you are looking for, just copy the file
-        
-    if find:
-      logp("  !! Failed to find '"+find+"' in "+fid)
-
-    pp = '\n'.join(pp)
-    if adb:
-      writeFile(localTmpFid, pp)
-      resp, rc = executeAdbLog("push "+localTmpFid+" "+fid)
-    else :
-      writeFile(fid, pp)
-    
+    body = readFile(fid)
   except IOError as err:
     logp("  !! Can't find: "+fid+" in "+os.getcwd())
     return False
 
+  pp = editText(fid, body, find, replace, insert, delete)
+  if pp!=body:  # (Leave the file, and its mtime, alone if nothing changed)
+    writeFile(fid, pp)
+  return True
+
+
+def editText(fid, body, find="<editMe>", replace=None, insert=None, delete=None):
+  '''Make an editFile edit to the text of file 'fid', returns the new text'''
+  lines = body.split('\n')
+  pp = []
+  for lnNo in range(0, len(lines)):
+    ln = lines[lnNo]  # Get lines by index number so we can inspect/insert/delete future lines
+    if ln[-1:]=='\r':  ln = ln[:-1]  # Remove \r from \r\n on windows systems
+    if find and ln.find(find)!=-1:  # Does this line contain the content we need to find?
+      find = None  # Remove the 'find' string now that we found it
+      if replace:  # If the line is to be replaced, replace it, otherwise add it
+        pp.append(replace)
+      elif not delete:
+        pp.append(ln)  # Keep this line, others may be inserted next
+      
+      if insert:  # Insert a list of lines, or just one line
+        # Avoid creating duplicate inserts if fixPart is run multiple times
+        firstInsert = insert if type(insert)==str else insert[0]
+        nextLn = lines[lnNo+1].rstrip('\r') if len(lines)>lnNo+1 else None  # (None at the end)
+        if nextLn!=firstInsert:
+          if type(insert)==list:
+            for il in insert:
+              pp.append(il)
+          else:
+            pp.append(insert)
+        else:
+          logp("  (ignoring duplicate insertion edit request for: '"+firstInsert+"'")
+    else:
+      pp.append(ln)  # This is not the line you are looking for, just copy the file
+      
+  if find:
+    logp("  !! Failed to find '"+find+"' in "+fid)
+  return '\n'.join(pp)
+
+
+def editRemote(edits):
+  '''Make editFile edits, a list of bunches of fid, find, replace, insert and delete, to
+  files on the device.  All the files are read in one sync session, all the edits to a
+  file are made to one copy of it here, and the changed files are copied back over the
+  originals in one shell session ('cat >', so they keep their owner and mode).  Returns
+  False if a file can't be read or written.
+  '''
+  fids = []
+  for ed in edits:
+    if ed.fid not in fids:
+      fids.append(ed.fid)
+  logp("  -- editRemote "+', '.join(fids)+": "+str(len(edits))+" edits")
+  try:
+    with adbClient.syncSession(devSerial()) as sc:
+      bodies = [sc.pullData(fid) for fid in fids]
+  except socket.error:  # No adb server, let streamPull use the adb program
+    bodies = [streamPull(fid).data for fid in fids]
+  except adbClient.adbError as ex:
+    logp("  !! can't read "+', '.join(fids)+": "+str(ex))
+    return False
+
+  bat = shellBatch()
+  for ii in range(0, len(fids)):
+    body = bodies[ii] if str==bytes else bodies[ii].decode("utf-8", "surrogateescape")
+    pp = body
+    for ed in edits:
+      if ed.fid==fids[ii]:
+        pp = editText(ed.fid, pp, ed.find, ed.get("replace"), ed.get("insert"),
+          ed.get("delete"))
+    if pp==body:
+      continue
+    tmpFid = "/data/local/tmp/rmcEdit"+str(ii)+".tmp"
+    if pushData(pp if str==bytes else pp.encode("utf-8", "surrogateescape"), tmpFid)==False:
+      return False
+    bat.add("cat "+tmpFid+" > "+fids[ii]+" && rm "+tmpFid)
+  ok = True
+  for resp, rc in bat.run():
+    if rc!=0:
+      logp("  !! can't write back an edited file: "+resp.strip())
+      ok = False
+  return ok
+
 
 def getDateTime(iList, fn):
   resp, rc = executeAdbLog("shell ls -l "+fn)
@@ -292,19 +572,18 @@ def findLine(data, searchStr):
 
 
 def executeAdbLog(cmd, showErr=True, ignore=None):
-  return executeAdb(cmd, showErr, ignore, log=True)
+  return executeAdb(cmd, showErr, log=True, ignore=ignore)
 
 
-def executeAdb(cmd, showErr=True, returnStr=True, log=False):
+def executeAdb(cmd, showErr=True, returnStr=True, log=False, ignore=None):
   '''Execute a command through ADB on android device, optionally specifying the TCP 
-  host name (and optional port number).  Either do it with logging or without
+  host name (and optional port number), or the device serial number.  Either do it
+  with logging or without.  (adbClient sends the command to the adb server itself,
+  rather than running the adb program, when it can.)
   '''
-  if 'arg' in sys.__dict__ and "host" in sys.arg:
-    host = sys.arg.host  # Was an explicity host device specified?
-    if host.find(':') == -1:
-      host += ":5555"
-  else:
-    host = ""
+  host = devSerial()
+  if host in adbClient.cancelled:  # (The adb program wouldn't know)
+    return ("error: device '"+host+"' was given up on\n", 1)
   if type(cmd) == list:
     cmd.insert(0, "adb")
     if host:
@@ -315,36 +594,652 @@ def executeAdb(cmd, showErr=True, returnStr=True, log=False):
     cmd = "adb "+hostOpt+cmd 
   
   if log:
-    return executeLog(cmd, showErr, returnStr);
+    return executeLog(cmd, showErr, ignore, run=adbClient.execute);
   else:
-    return execute(cmd, showErr, returnStr);
+    return adbClient.execute(cmd, showErr, returnStr);
+
+
+class shellBatch(object):
+  '''Collect adb shell commands and run them all in one 'adb shell' session, rather than
+  one session per command.  Each command's output is bracketed by sentinel lines (with
+  its exit status) so it can be separated out again.  Each command is run as a { } group
+  with its stderr going to its output, so all the parts of a compound command (a; b,
+  a || b, a | b) are caught, not just the last.  ie:
+    bat = shellBatch()
+    bat.add("rm /cache/x", ignore="No such file")
+    bat.add("sync")
+    for resp, rc in bat.run(): ...
+  '''
+  maxScript = 3000  # Older adbd's limit a command to 4K, longer batches are split up
+
+  def __init__(self, log=True):
+    self.cmds = []
+    self.log = log
+
+  def add(self, cmd, ignore=None):
+    '''Queue a command, 'ignore' works as for executeAdbLog.  Returns its index.'''
+    self.cmds.append(bunch(cmd=cmd, ignore=ignore))
+    return len(self.cmds)-1
+
+  def run(self):
+    '''Run the queued commands, returns a list of [resp, rc], one for each command'''
+    res = []
+    start = 0
+    while start<len(self.cmds):
+      sent = "rmc%06x" % random.randint(0, 0xffffff)
+      script = []
+      size = 0
+      for ii in range(start, len(self.cmds)):
+        ln = "echo "+sent+":B:"+str(ii)+"; { "+self.cmds[ii].cmd.rstrip("; ")+"; } 2>&1; r=$?; " \
+          +"echo; echo "+sent+":E:"+str(ii)+":$r"
+        if len(script)>0 and size+len(ln)>self.maxScript:
+          break
+        script.append(ln)
+        size += len(ln)+2
+      resp, rc = executeAdb(["shell", "; ".join(script)])
+      for ii in range(start, start+len(script)):
+        mm = re.search(sent+":B:"+str(ii)+r"\r*\n(.*?)\r*\n"+sent+":E:"+str(ii)+r":(\d+)",
+          resp, re.DOTALL)
+        res.append([mm.group(1), int(mm.group(2))] if mm else [resp, rc or 1])
+      start += len(script)
+
+    if self.log:
+      for ii in range(0, len(self.cmds)):
+        cmd = self.cmds[ii]
+        if not (cmd.ignore and res[ii][0].find(cmd.ignore)!=-1):
+          printTag("    'adb shell "+cmd.cmd+"'  (rc="+str(res[ii][1])+", batched)\n"
+            +prefix('      |', res[ii][0]))
+        log("", cmd="adb shell "+cmd.cmd, rc=res[ii][1], bytes=len(res[ii][0]), out=res[ii][0],
+          batched=True)
+    self.cmds = []
+    return res
+
+
+xferChunk = 1024*1024  # Resumable transfers go in chunks of this size ...
+xferBlock = 64*1024  # ... dd'ed on the device in blocks of this size
+xferRetries = 3  # Times in a row a transfer may be interrupted before it gives up
+xferWaitSecs = 60  # How long to wait for the device to come back after an interruption
+
+
+def streamPull(remote, localFid=None, limit=None):
+  '''Copy a file, usually a partition's block device, from the device straight into a
+  local file (or into memory if localFid is None) without staging a copy on the device.
+  If the device drops out part way through, the copy is resumed (see pullResume).
+  Returns a bunch with size, md5 (hex digest) and data (if localFid is None).
+  '''
+  startTm = time.time()
+  fp = open(localFid, 'wb') if localFid else io.BytesIO()
+  try:
+    try:
+      size, md5 = adbClient.pullStream(devSerial(), remote, fp, limit)
+    except (socket.error, adbClient.adbError) as ex:
+      if fp.tell()>0:  # It had started, so the device dropped out, pick up where it stopped
+        size, md5 = pullResume(remote, fp, localFid, limit, ex) or [0, None]
+        if md5==None:  # (It didn't come back, keep nothing)
+          fp.seek(0)
+          fp.truncate()
+          md5 = fileHash.md5Data(b"")
+      else:
+        # No adb server (or it failed), let the adb program do the pull, then hash it
+        fp.close()
+        tmpFid = localFid or workspace("examImgPull.tmp")
+        resp, rc = executeAdbLog("pull "+remote+" "+tmpFid)
+        data = b""
+        if os.path.isfile(tmpFid):
+          with open(tmpFid, 'rb') as tf:
+            data = tf.read(limit) if limit else tf.read()
+          if not localFid:
+            os.remove(tmpFid)
+        fp = open(localFid, 'wb') if localFid else io.BytesIO()
+        fp.write(data)
+        size, md5 = len(data), fileHash.md5Data(data)
+    res = bunch(size=size, md5=md5)
+    if not localFid:
+      res.data = fp.getvalue()
+  finally:
+    fp.close()
+  if localFid:
+    fileHash.remember(localFid, md5)  # So it need not be read again to hash it
+  logp("    streamed "+remote+" -> "+(localFid or "(memory)")+": "+str(size)+" bytes, %.1f sec, md5 "
+    % (time.time()-startTm)+md5)
+  profile("adb", "pull stream", time.time()-startTm, bytesIn=size)
+  return res
+
+
+def pushData(data, remote):
+  '''Write a buffer to a file on the device'''
+  try:
+    startTm = time.time()
+    with adbClient.syncSession(devSerial()) as sc:
+      sc.pushData(data, remote)
+    profile("adb", "push data", time.time()-startTm, bytesOut=len(data))
+    return True
+  except socket.error:
+    tmpFid = workspace("examImgPush.tmp")  # No adb server, let the adb program push it
+    with open(tmpFid, 'wb') as fp:
+      fp.write(data)
+    resp, rc = executeAdbLog("push "+tmpFid+" "+remote)
+    os.remove(tmpFid)
+    return rc==0
+  except adbClient.adbError as ex:
+    logp("  !! can't write "+remote+": "+str(ex))
+    return False
 
 
-def executeLog(cmd, showErr=True, ignore=None):
+def remoteMd5Cmd(fid, size=None):
+  '''Return a shell command that prints the md5 of a device file, or of just its
+  first 'size' bytes, ie the part of a partition that an image was written to
+  '''
+  if size==None:
+    return "md5sum "+fid
+  bs = 1
+  for bb in [65536, 4096, 2048, 1024, 512]:  # Use the biggest block size that fits
+    if size%bb==0:
+      bs = bb
+      break
+  return "dd if="+fid+" bs="+str(bs)+" count="+str(size//bs)+" 2>/dev/null | md5sum"
+
+
+def parseMd5(resp):
+  '''Return the md5 hex digest from md5sum output, or None (ie no md5sum program)'''
+  mm = re.match(r"\s*([0-9a-fA-F]{32})\b", resp)
+  return mm.group(1).lower() if mm else None
+
+
+def partMatches(localFid, partFids, prefixSize=64*1024):
+  '''Check if an image file is already on one or more partitions of the device, by md5,
+  in one adb round trip.  The device hashes the first 'prefixSize' bytes of each
+  partition and, only if that matches the image, goes on to hash the whole length of
+  the image.  Returns True if they all match, False if not, or None if the device
+  can't tell us (no md5sum).
+  '''
+  size = os.path.getsize(localFid)
+  prefixSize = min(prefixSize, size)
+  md5 = fileHash.md5File(localFid)
+  prefixMd5 = fileHash.md5File(localFid, prefixSize)
+  bat = shellBatch()
+  for partFid in partFids:
+    # Prints the whole md5 if the prefix matched, else the prefix md5 (which won't match)
+    bat.add("p=$("+remoteMd5Cmd(partFid, prefixSize)+"); case $p in "+prefixMd5+"*) "
+      +remoteMd5Cmd(partFid, size)+";; *) echo \"$p\";; esac")
+  match = True
+  for resp, rc in bat.run():
+    devMd5 = parseMd5(resp)
+    if devMd5==None:
+      return None
+    match = match and devMd5==md5
+  return match
+
+
+def streamFlash(localFid, partFids, chunkSize=None):
+  '''Write an image file to one or more partitions (block devices) on the device, then
+  check the md5 of what was written.  The image goes over USB once, a chunk at a time,
+  through a small buffer file in /dev (a RAM filesystem) and is dd'ed from there into
+  each partition, so nothing is written to /cache and images of any size can be
+  flashed.  If the device drops out, the chunk it was on is sent again once it is back.
+  Returns True if it was written (and verified, if the device has md5sum).
+  '''
+  tmpFid = "/dev/rmcFlash.tmp"
+  chunkSize = chunkSize or xferChunk
+  size = os.path.getsize(localFid)
+  md5 = fileHash.md5File(localFid)
+  bs = 4096  # chunkSize must be a multiple of bs
+  off, fails = 0, 0
+  with open(localFid, 'rb') as fp:
+    while off<size:
+      fp.seek(off)
+      err = None
+      if pushData(fp.read(chunkSize), tmpFid)==False:
+        err = "can't push the chunk at offset "+str(off)
+      else:
+        bat = shellBatch(log=False)
+        for partFid in partFids:
+          bat.add("dd if="+tmpFid+" of="+partFid+" bs="+str(bs)+" seek="+str(off//bs))
+        for resp, rc in bat.run():
+          if rc!=0:
+            err = "dd to partition failed at offset "+str(off)+": "+resp
+      if err:
+        fails += 1
+        if not xferResume("flash of "+localFid, err, fails):
+          logp("  !! "+err)
+          return False
+        continue
+      off += chunkSize
+      fails = 0
+
+  bat = shellBatch()
+  bat.add("rm "+tmpFid)
+  for partFid in partFids:
+    bat.add(remoteMd5Cmd(partFid, size))
+  res = bat.run()
+  ok = True
+  for ii in range(0, len(partFids)):
+    devMd5 = parseMd5(res[ii+1][0])
+    if devMd5==None:
+      logp("    (can't verify "+partFids[ii]+", no md5sum on the device)")
+    elif devMd5!=md5:
+      logp("  !! "+partFids[ii]+" md5 "+devMd5+" doesn't match "+localFid+" md5 "+md5)
+      ok = False
+  if ok:
+    logp("    wrote "+localFid+" ("+str(size)+" bytes, md5 "+md5+") to "+', '.join(partFids))
+  return ok
+
+
+def xferResume(what, err, fails, retries=None):
+  '''A transfer to or from the device was interrupted by 'err' (ie the USB cable
+  dropped out), the 'fails'th time in a row.  Wait for the device to come back, returns
+  False if it didn't, or if this has happened more than 'retries' (default xferRetries)
+  times.
+  '''
+  logp("  -- "+what+" interrupted: "+str(err))
+  if fails>(xferRetries if retries==None else retries):
+    return False
+  adbClient.closeAll(devSerial())  # (The pooled sync connections went with the device)
+  time.sleep(1)  # (Give adb a moment to see that it's gone)
+  if deviceTracker().wait(["device", "recovery"], xferWaitSecs, devSerial())==None:
+    logp("  !! the device didn't come back")
+    return False
+  logp("    resuming "+what)
+  return True
+
+
+def xferTmp(remote):
+  '''Return the name of the buffer file in /dev (a RAM filesystem) that chunks of
+  'remote' go through on the device (one per file, so transfers can run at once)
+  '''
+  return "/dev/rmc"+fileHash.md5Data(remote.encode("utf-8"))[:8]+".tmp"
+
+
+def chunkMd5s(fp, size):
+  '''Return the md5's of each xferChunk of the first 'size' bytes of an open file'''
+  md5s = []
+  fp.seek(0)
+  for off in range(0, size, xferChunk):
+    md5s.append(fileHash.md5Stream(fp, min(xferChunk, size-off)))
+  return md5s
+
+
+def remoteChunkMd5s(remote, count):
+  '''Return the md5's of the first 'count' xferChunks of a device file, hashed on the
+  device in one batch (None for any it couldn't hash, ie if it has no md5sum)
+  '''
+  bat = shellBatch(log=False)
+  blks = xferChunk//xferBlock
+  for ii in range(0, count):
+    bat.add("dd if="+remote+" bs="+str(xferBlock)+" skip="+str(ii*blks)+" count="+str(blks)
+      +" 2>/dev/null | md5sum")
+  return [parseMd5(resp) for resp, rc in bat.run()] if count else []
+
+
+def pullResume(remote, fp, localFid, limit, err):
+  '''streamPull lost the device part way through 'remote' ('fp' has what it got).  Wait
+  for the device to come back, keep the whole chunks that the device agrees with (by
+  md5), and get the rest a chunk at a time: each is dd'ed into a buffer file in /dev,
+  pulled, and checked against the device's md5 of it.  Returns [size, md5], or None if
+  the device didn't come back.
+  '''
+  startTm = time.time()
+  tmpFid = xferTmp(remote)
+  blks = xferChunk//xferBlock
+  have, fails = None, 1
+  while True:
+    if not xferResume("pull of "+remote, err, fails):
+      return None
+    try:
+      if have==None:
+        have = fp.tell()//xferChunk*xferChunk
+        fp.flush()
+        with (open(localFid, 'rb') if localFid else io.BytesIO(fp.getvalue())) as rf:
+          md5s = chunkMd5s(rf, have)
+        kept = 0  # (A chunk the device can't hash was just read from it, so it's kept)
+        for md5, devMd5 in zip(md5s, remoteChunkMd5s(remote, len(md5s))):
+          if devMd5 not in [None, md5]:
+            break
+          kept += 1
+        have = kept*xferChunk
+        fp.seek(have)
+        fp.truncate()
+        logp("    kept "+str(have)+" bytes, getting the rest of "+remote+" in chunks")
+      while limit==None or have<limit:
+        out = adbClient.shell(devSerial(), "rm "+tmpFid+" 2>/dev/null; dd if="+remote+" of="
+          +tmpFid+" bs="+str(xferBlock)+" skip="+str(have//xferBlock)+" count="+str(blks)
+          +" 2>/dev/null; md5sum "+tmpFid)
+        with adbClient.syncSession(devSerial()) as sc:
+          data = sc.pullData(tmpFid)
+        devMd5 = parseMd5(out.decode("ISO-8859-1"))
+        if devMd5 not in [None, fileHash.md5Data(data)]:
+          raise adbClient.adbError("the chunk at "+str(have)+" doesn't match its md5")
+        if limit!=None:
+          data = data[:limit-have]
+        fp.write(data)
+        have += len(data)
+        fails = 0
+        if len(data)<xferChunk:
+          break
+      adbClient.shell(devSerial(), "rm "+tmpFid)
+      break
+    except (socket.error, adbClient.adbError) as ex:
+      err = ex
+      fails += 1
+
+  fp.flush()
+  with (open(localFid, 'rb') if localFid else io.BytesIO(fp.getvalue())) as rf:
+    md5 = fileHash.md5Stream(rf)
+  profile("adb", "pull chunks", time.time()-startTm)
+  return [have, md5]
+
+
+def xferPush(localFid, remote, retries=None):
+  '''Copy a local file to the device so that, if the device drops out (ie a flaky USB
+  cable), the copy picks up where it left off.  Files bigger than xferChunk go a chunk
+  at a time: each is pushed to a buffer file in /dev, checked against its md5 on the
+  device and dd'ed into place (seek=).  The chunks already there (from an interrupted
+  copy, or an older copy that starts the same) are not sent again.  Returns True if it
+  was copied (and verified, if the device has md5sum).  'retries' is how many times in a
+  row it may be interrupted (see xferResume), 0 gives up at the first interruption.
+  '''
+  size = os.path.getsize(localFid)
+  if size<=xferChunk:
+    resp, rc = executeAdbLog("push "+localFid+" "+remote)
+    return rc==0
+  startTm = time.time()
+  tmpFid = xferTmp(remote)
+  mode = "%o" % (os.stat(localFid).st_mode&0o777)  # (dd doesn't set it, as sync SEND does)
+  md5 = fileHash.md5File(localFid)
+  with open(localFid, 'rb') as fp:
+    md5s = chunkMd5s(fp, size)
+    start, sent, fails, err = None, 0, 0, None
+    while True:
+      if err and not xferResume("push of "+localFid, err, fails, retries):
+        return False
+      try:
+        if start==None:
+          start = xferStart(remote, size, md5s)
+        for ii in range(start, len(md5s)):
+          fp.seek(ii*xferChunk)
+          data = fp.read(xferChunk)
+          with adbClient.syncSession(devSerial()) as sc:
+            sc.pushData(data, tmpFid)
+          # (A device with no md5sum prints nothing, the sync push will have to do)
+          out = adbClient.shell(devSerial(), "m=$(md5sum "+tmpFid+" 2>/dev/null); case $m in "
+            +md5s[ii]+"*|'') "+("rm "+remote+" 2>/dev/null; " if ii==0 else "")+"dd if="+tmpFid
+            +" of="+remote+" bs="+str(xferBlock)+" seek="+str(ii*xferChunk//xferBlock)
+            +" 2>&1 && echo rmcChunkOk;; *) echo \"bad chunk: $m\";; esac; rm "+tmpFid)
+          if b"rmcChunkOk" not in out:
+            raise adbClient.adbError("chunk "+str(ii)+": "+out.decode("ISO-8859-1").strip())
+          start, sent, fails = ii+1, sent+len(data), 0
+        devMd5 = parseMd5(adbClient.shell(devSerial(), "chmod "+mode+" "+remote+"; md5sum "
+          +remote).decode("ISO-8859-1"))
+        if devMd5 not in [None, md5]:
+          start = None  # (Find the chunks that don't match, and send them again)
+          raise adbClient.adbError(remote+" md5 "+devMd5+" doesn't match "+md5)
+        break
+      except adbClient.noServerError as ex:
+        if start==None and fails==0:  # No adb server, let the adb program push it
+          resp, rc = executeAdbLog("push "+localFid+" "+remote)
+          return rc==0
+        err, fails = ex, fails+1
+      except socket.error as ex:
+        err, fails = ex, fails+1
+      except adbClient.adbError as ex:
+        err, fails = ex, fails+1
+
+  logp("    pushed "+localFid+" -> "+remote+": "+str(sent)+" of "+str(size)+" bytes sent, "
+    "%.1f sec, md5 " % (time.time()-startTm)+md5)
+  profile("adb", "push chunks", time.time()-startTm, bytesOut=sent)
+  return True
+
+
+def xferStart(remote, size, md5s):
+  '''Return the index of the first chunk of a file that xferPush must send, ie the
+  first that doesn't match the device's copy of it'''
+  with adbClient.syncSession(devSerial()) as sc:
+    rMode, rSize, rTime = sc.stat(remote)
+  if rSize==0 or rSize>size:
+    return 0
+  devMd5s = remoteChunkMd5s(remote, (rSize+xferChunk-1)//xferChunk)
+  start = 0
+  while start<len(devMd5s) and devMd5s[start]==md5s[start]:
+    start += 1
+  if start:
+    logp("    "+str(start)+" of "+str(len(md5s))+" chunks of "+remote+" are already there")
+  return start
+
+
+def pushFiles(files):
+  '''Push a list of [local file, remote file] to the device: the small ones one after
+  another on one sync connection, the big ones (over xferChunk) with xferPush, so they
+  can be resumed.  Returns the list of local files that couldn't be pushed.
+  '''
+  small = [fl for fl in files if os.path.getsize(fl[0])<=xferChunk]
+  failed = [fl[0] for fl in files if fl not in small and not xferPush(fl[0], fl[1])]
+  if len(small)==0:
+    return failed
+  startTm = time.time()
+  size = 0
+  done = []
+  try:
+    with adbClient.syncSession(devSerial()) as sc:
+      for localFid, remote in small:
+        try:
+          size += sc.push(localFid, remote)
+          logp("    pushed "+localFid+" -> "+remote)
+        except adbClient.adbError as ex:
+          logp("  !! can't push "+localFid+" to "+remote+": "+str(ex))
+          failed.append(localFid)
+        done.append(localFid)
+    profile("adb", "push files", time.time()-startTm, bytesOut=size)
+  except socket.error:  # No adb server (or the device dropped out), do the rest one by one
+    for localFid, remote in small:
+      if localFid not in done and xferPush(localFid, remote)==False:
+        failed.append(localFid)
+  return failed
+
+
+def executeFastbootLog(cmd):
+  '''Execute a fastboot command (with logging) on the selected device'''
+  serial = sys.arg.get("serial", "") if 'arg' in sys.__dict__ else ""
+  if serial in adbClient.cancelled:
+    return ("error: device '"+serial+"' was given up on\n", 1)
+  def started(proc):
+    with fastbootLock:  # (So cancelDevice either kills it, or it sees the cancel)
+      if serial in adbClient.cancelled:
+        proc.kill()
+      else:
+        fastbootProcs[serial] = proc
+  try:
+    return executeLog("fastboot "+("-s "+serial+" " if serial else "")+cmd,
+      run=lambda cmd, showErr: execute(cmd, showErr, started=started))
+  finally:
+    with fastbootLock:
+      fastbootProcs.pop(serial, None)
+
+
+fastbootProcs = {}  # {serial: the fastboot process running for it}
+fastbootLock = threading.Lock()
+
+def cancelDevice(serial):
+  '''Give up on a device (ie a fleet run timed out on it): the adb connections to it are
+  shut down (adbClient.cancel), the fastboot command running for it is killed, and every
+  adb or fastboot command for it fails from now on.
+  '''
+  with fastbootLock:
+    adbClient.cancel(serial)
+    proc = fastbootProcs.pop(serial, None)
+  if proc:
+    try:
+      proc.kill()
+    except OSError:
+      pass  # (It just finished)
+
+
+def executeLog(cmd, showErr=True, ignore=None, run=execute):
   '''Execute an operating system command and log the command and response'''
   print("    Executing: '"+str(cmd)+"'")
-  ret = execute(cmd, showErr)
-  resp = "    '"+str(cmd)+"'  (rc="+str(ret[1])+")\n"+prefix('      |', ret[0])
+  startTm = time.time()
+  ret = run(cmd, showErr)
+  fields = dict(cmd=str(cmd), rc=ret[1], secs=round(time.time()-startTm, 3), bytes=len(ret[0]),
+    out=ret[0])
   if ignore and ret[0].find(ignore)!=-1:  # Does the response contain the string to ignore
-    log(resp)  # This error response is okay, don't print to console
+    log("", **fields)  # This error response is okay, don't print to console
     # Usually done with a command which is okay to fail, like erasing a file that is not there.
   else :
-    logp(resp)
+    printTag("    '"+str(cmd)+"'  (rc="+str(ret[1])+")\n"+prefix('      |', ret[0]))
+    log("", **fields)
   return ret
 
 
-def log(msg, prefix=""):
-  fp = open(logFid, 'ab')
-  if prefix:
-    fp.write(str.encode(prefix))  # Usually used to prefix line with a \n LF
-  ts = datetime.datetime.now().strftime("%y/%m/%d-%H:%M:%S")
-  fp.write(str.encode(ts+" "+msg+'\n'))
-  fp.close()
+class logWriter(object):
+  '''A log file that is kept open, written through a buffer.  The buffers of all the
+  log files are flushed every second (by a background thread) and at exit.
+  '''
+  def __init__(self, fid):
+    self.fid = fid
+    self.lock = threading.Lock()
+    self._open()
+
+  def _open(self):
+    self.fp = open(self.fid, 'ab', 64*1024)
+    self.size = os.path.getsize(self.fid)
+
+  def write(self, data):
+    with self.lock:
+      if self.size>0 and self.size+len(data)>logMaxSize:
+        self._rotate()
+      self.fp.write(data)
+      self.size += len(data)
+
+  def _rotate(self):
+    self.fp.close()
+    for ii in range(logKeep, 0, -1):  # fid.2 -> fid.3, fid.1 -> fid.2, fid -> fid.1
+      old = self.fid+('.'+str(ii-1) if ii>1 else "")
+      if os.path.isfile(old):
+        if os.path.isfile(self.fid+'.'+str(ii)):
+          os.remove(self.fid+'.'+str(ii))  # (Windows won't rename over a file)
+        os.rename(old, self.fid+'.'+str(ii))
+    self._open()
+
+  def flush(self):
+    with self.lock:
+      self.fp.flush()
+
+
+_logs = {}  # {log file name: logWriter}
+_logsLock = threading.Lock()
+
+def logWriterFor(fid):
+  with _logsLock:
+    if fid not in _logs:
+      if len(_logs)==0:  # First log, start the thread that flushes them
+        th = threading.Thread(target=_flushLoop)
+        th.daemon = True
+        th.start()
+      _logs[fid] = logWriter(fid)
+    return _logs[fid]
+
+
+def flushLogs():
+  with _logsLock:
+    writers = list(_logs.values())
+  for lw in writers:
+    lw.flush()
+
+atexit.register(flushLogs)
+
+
+def _flushLoop():
+  while True:
+    time.sleep(1)
+    flushLogs()
+
+
+def profile(kind, label, secs, bytesIn=0, bytesOut=0, spawn=0):
+  '''Record an operation, for the objective being done, for reviveMC74 -p (see perfStats)'''
+  perfStats.record(getattr(logCtx, "objective", None), kind, label, secs, bytesIn, bytesOut,
+    spawn)
+
+
+def _execStats(cmd, spawn, secs, size):
+  label = os.path.basename(cmd[0])
+  for tok in cmd[1:]:  # For adb and fastboot, add the command, ie 'adb push'
+    if label in ["adb", "fastboot"] and tok[:1]!='-' and tok!=devSerial():
+      label += ' '+tok
+      break
+  profile("exec", label, secs, bytesIn=size, spawn=spawn)
+
+ribou.execStats = _execStats
+adbClient.stats = lambda verb, secs, bytesIn, bytesOut: profile("adb", verb, secs, bytesIn,
+  bytesOut)
+
+
+def log(msg, **fields):
+  '''Add a record to the log, one line of JSON: 'ts' (timestamp), 'serial', 'objective',
+  'msg' and any other 'fields' (ie executeLog's cmd, rc, secs, bytes and out).
+  '''
+  # In a fleet run, each device thread has its own log file, see reviveMC74.fleetFunc
+  fid = sys.arg.get("logFid", logFid) if 'arg' in sys.__dict__ else logFid
+  rec = dict(ts=datetime.datetime.now().strftime("%y/%m/%d-%H:%M:%S.%f")[:-3],
+    serial=devSerial() if 'arg' in sys.__dict__ else "",
+    objective=getattr(logCtx, "objective", None))
+  if msg:
+    rec["msg"] = msg
+  rec.update(fields)
+  if str==bytes:  # (Python 2, adb output may not be utf-8)
+    for nn, vv in rec.items():
+      if type(vv)==str:
+        rec[nn] = vv.decode("ISO-8859-1")
+  logWriterFor(fid).write((json.dumps(rec, sort_keys=True)+'\n').encode("utf-8"))
+
+
 
 
-def logp(msg, prefix=""):
-  print(prefix+msg)
-  log(msg, prefix=prefix)
+def journalFid(serial):
+  return "reviveMC74-"+serial.replace(':', '_')+".journal"
+
+
+def readJournal(serial):
+  '''Return {objective: inputs} from the device's journal, the inputs recorded the last
+  time each objective was completed on it
+  '''
+  done = {}
+  try:
+    with open(journalFid(serial), 'rb') as fp:
+      for ln in fp:
+        try:
+          ent = json.loads(ln.decode("utf-8"))
+          done[ent["objective"]] = ent["inputs"]
+        except (ValueError, KeyError):
+          pass  # (A line cut short by a crash, ignore it)
+  except (IOError, OSError):
+    pass  # No journal yet
+  return done
+
+
+def appendJournal(serial, objective, inputs):
+  '''Record in the device's journal that 'objective' was completed using 'inputs' (a
+  dict, ie of file md5s).  Each entry is one line, written with one O_APPEND write
+  and synced, so a crash never leaves a half written entry in the middle of the file.
+  '''
+  ent = json.dumps(dict(objective=objective, inputs=inputs,
+    time=datetime.datetime.now().strftime("%y/%m/%d-%H:%M:%S")), sort_keys=True)
+  fd = os.open(journalFid(serial), os.O_WRONLY|os.O_APPEND|os.O_CREAT|getattr(os, "O_BINARY", 0))
+  try:
+    os.write(fd, (ent+'\n').encode("utf-8"))
+    os.fsync(fd)
+  finally:
+    os.close(fd)
+
+
+def printTag(msg, prefix=""):
+  '''Print a message, tagged with the device serial in fleet runs'''
+  tag = sys.arg.get("tag", "") if 'arg' in sys.__dict__ else ""
+  print(prefix+tag+msg)
+
+
+def logp(msg, prefix="", **fields):
+  '''Print a message ('prefix' first, ie a blank line) and add it to the log'''
+  printTag(msg, prefix)
+  log(msg, **fields)
 
 
 def prefix(prefix, msg):
@@ -405,6 +1300,33 @@ def dbGetRow(dbFile, tblName, colName, colVal):
   return row
 
 
+def dbGetRows(dbFile, tblName, where=None):
+  '''Retrieve all the rows of an SQL DB table (or those matching a 'where' clause) with
+  one sqlite3 command.  Returns a list of bunches of the column values (all str's), or
+  None if the table can't be read.
+  ie: dbGetRows(ldb, "favorites", "container=-101")
+  '''
+  sqlCmd = "select * from "+tblName+(" where "+where if where else "")
+  print("-- "+sqlCmd+"; --")
+  resp, rc = executeAdb(["shell", "sqlite3", "-line", dbFile, '"'+sqlCmd+'"'])
+  rows = []
+  row = None
+  for ln in resp.replace('\r', '').split("\n"):
+    if ln.startswith("Error:"):
+      logp("  !! "+sqlCmd+": "+ln)
+      return None
+    # Each row is lines of:  colName = colValue   with an empty line between rows
+    ln = ln.split(" = ", 1)
+    if len(ln)<2:
+      row = None
+      continue
+    if row==None or ln[0].strip() in row:
+      row = bunch()
+      rows.append(row)
+    row[ln[0].strip()] = ln[1]
+  return rows
+
+
 def dbSetCell(dbFile, tblName, selColName, selColVal, colName, colVal):
   '''Update one column in one row of an SQL DB table.
   ie: dbSetCell(ldb, "allapps", "title", "wPhone", "title", "MC74")
@@ -441,62 +1363,205 @@ def dbAddRow(dbFile, tblName, vals):
 
 
 ldb = "/data/data/com.teslacoilsw.launcher/databases/launcher.db"  # for testing
-def initLauncher():
-  ldb = "/data/data/com.teslacoilsw.launcher/databases/launcher.db"
-  mcComp = "revive.MC74/org.linphone.activities.LinphoneLauncherActivity"
-  favInt = "#Intent;action=android.intent.action.MAIN;category=android.intent.category.LAUNCHER;launchFlags=0x10200000;component=%s;end"
-  # Switch the Phone favorite in the upper right (dock position 0) to reviveMC74
-  print("\nSwitch Phone favorite to reviveMC74")
-  resp = dbSetCell(ldb, "favorites", "title", "Phone", "intent", favInt % mcComp)
-  print(resp)
-  print("\nMove Show Apps icon to lower right")
-  resp = dbSetCell(ldb, "favorites", "_id", 1, "hotSeatRank", 0)
-  print(resp)
-  
-  favRow = bunch(flingAsTap= 'false', itemType= '0', appWidgetId= '-1',
+def sqlVal(vv):
+  '''Format a value as an SQL literal'''
+  if type(vv) in [int, float]:
+    return str(vv)
+  return "'"+str(vv).replace("'", "''")+"'"
+
+
+class sqlBatch(object):
+  '''Collect SQL statements for a database on the device and run them all in one
+  transaction with one sqlite3 command, rather than one 'adb shell sqlite3' per
+  statement.  The script is pushed to the device and given to sqlite3 on stdin (so it
+  need not be quoted for the shell and can be any length).  sqlite3 stops at the first
+  statement that fails (.bail on) without committing, so the database is changed by all
+  of them or none.  ie:
+    bat = sqlBatch(ldb)
+    bat.setCell("favorites", "title", "Phone", "intent", "#Intent;...")
+    bat.add("delete from favorites where title='Google'")
+    for rr in bat.run(): print(rr.sql, rr.changes, rr.error, rr.out)
+  '''
+  scriptFid = "/data/local/tmp/rmcSql.tmp"
+
+  def __init__(self, dbFile):
+    self.dbFile = dbFile
+    self.stmts = []
+
+  def add(self, sql):
+    '''Queue an SQL statement, returns its index'''
+    self.stmts.append(sql.strip().rstrip(';'))
+    return len(self.stmts)-1
+
+  def setCell(self, tblName, selColName, selColVal, colName, colVal):
+    '''Queue an update of one column in the rows selected (like dbSetCell)'''
+    return self.setCells(tblName, selColName, selColVal, {colName: colVal})
+
+  def setCells(self, tblName, selColName, selColVal, vals):
+    '''Queue an update of the columns in the bunch/dict 'vals' in the rows selected'''
+    return self.add("update %s set %s where %s=%s" % (tblName, ", ".join([nm+"="
+      +sqlVal(vals[nm]) for nm in vals]), selColName, sqlVal(selColVal)))
+
+  def addRow(self, tblName, vals):
+    '''Queue an insert of a row, the values are in a bunch/dict (like dbAddRow)'''
+    names = list(vals.keys())
+    return self.add("insert into %s (%s) values (%s)" % (tblName, ", ".join(names),
+      ", ".join([sqlVal(str(vals[nm])) for nm in names])))
+
+  def run(self):
+    '''Run the queued statements, returns a list of bunches, one for each: sql, out (a
+    list of its output lines), changes (the number of rows it changed) and error
+    (sqlite3's error message, or None).  If a statement failed, nothing was changed: it
+    has sqlite3's error, the ones before it 'rolled back' and those after it 'not run'.
+    Returns None if sqlite3 could not be run.
+    '''
+    sent = "rmc%06x" % random.randint(0, 0xffffff)
+    script = [".bail on", "BEGIN;"]
+    for ii in range(0, len(self.stmts)):
+      script.append(self.stmts[ii]+";")
+      script.append("select '"+sent+":"+str(ii)+":'||changes();")  # Ends its output
+    script.append("COMMIT;")
+    script = '\n'.join(script)+'\n'
+    if pushData(script if str==bytes else script.encode("utf-8"), self.scriptFid)==False:
+      return None
+    resp, rc = executeAdbLog(["shell", "sqlite3 "+self.dbFile+" < "+self.scriptFid
+      +" 2>&1; rm "+self.scriptFid])
+
+    res = [bunch(sql=sql, out=[], changes=0, error=None) for sql in self.stmts]
+    ii = 0
+    failed = None
+    for ln in resp.replace('\r', '').split('\n'):
+      mm = re.match(sent+r":(\d+):(\d+)$", ln)
+      if mm:
+        res[int(mm.group(1))].changes = int(mm.group(2))
+        ii = int(mm.group(1))+1
+      elif ii<len(res) and ln:
+        res[ii].out.append(ln)
+        if re.match(r"(Parse |Runtime )?Error\b", ln):  # (Newer sqlite3's say which)
+          res[ii].error = ln
+          failed = ii
+    if failed!=None:  # sqlite3 stopped there, and the transaction was never committed
+      for jj in range(0, len(res)):
+        res[jj].changes = 0
+        if jj!=failed:
+          res[jj].error = "rolled back" if jj<failed else "not run"
+      logp("  !! "+res[failed].sql+": "+res[failed].error+" ("+self.dbFile
+        +" was not changed)")
+      return res
+    if ii<len(res):  # sqlite3 didn't run, or stopped part way
+      logp("  !! sqlite3 "+self.dbFile+" failed: "+resp.strip())
+      return None
+    return res
+
+
+launcherDb = "/data/data/com.teslacoilsw.launcher/databases/launcher.db"
+favInt = "#Intent;action=android.intent.action.MAIN;category=android.intent.category.LAUNCHER;launchFlags=0x10200000;component=%s;end"
+
+def favorite(**vals):
+  '''A row for the favorites table: an icon on home screen 1, with 'vals' added'''
+  fav = bunch(flingAsTap= 'false', itemType= '0', appWidgetId= '-1',
     zOrder= '0', iconType= '2', container= '-100', spanX= '1.0', spanY= '1.0',
     cellX= '0.0', cellY= '5.0', screen= '1', flags= '0', profileId= '-1',
     restored= '0')
-  
-  logp("phone row: "+str(favRow))
-  
-  resp = dbCmd(ldb, "delete from favorites where _id>=12 and _id<=14")
-  print(resp)
-  
-  print("\nAdd dolphin Browser favorite:")
-  dolphComp = "mobi.mgeek.TunnyBrowser/.SplashActivity"
-  favRow.update(_id=12, cellX=0.0, title='Browser', intent=favInt % dolphComp, 
-    iconResource="mobi.mgeek.TunnyBrowser/.SplashActivity")
-  resp = dbAddRow(ldb, "favorites", favRow)
-  print(resp)
-  
-  print("\nAdd magicEarth/Map favorite:")
-  earthComp = "com.generalmagic.magicearth/com.generalmagic.android.map.MapActivity;l.profile=0"
-  favRow.update(_id=13, cellX=1.0, title='Maps', intent=favInt % earthComp,
-    iconResource="com.generalmagic.magicearth/com.generalmagic.android.map.MapActivity")
-  resp = dbAddRow(ldb, "favorites", favRow)
-  print(resp)
-  
-  print("\nAdd riboVideo favorite:")
-  VPComp = "ribo.vp/.VPcontrol"
-  favRow.update(_id=14, cellX=2.0, title='riboVideo', intent=favInt % VPComp,
-    iconResource="ribo.vp/.VPcontrol")
-  resp = dbAddRow(ldb, "favorites", favRow)
-  print(resp)
-  
+  fav.update(vals)
+  return fav
+
+launcherProfile = bunch(  # How initLauncher sets up the Nova Launcher's favorites table
+  update = [  # [column, value selecting the rows, bunch of the values they should have]
+    # Switch the Phone favorite in the upper right (dock position 0) to reviveMC74
+    ["title", "Phone", bunch(intent=favInt
+      % "revive.MC74/org.linphone.activities.LinphoneLauncherActivity")],
+    # Move Show Apps icon to lower right
+    ["_id", 1, bunch(hotSeatRank=0)]
+  ],
+  rows = [  # Favorites that should be there, by _id
+    favorite(_id=12, cellX=0.0, title='Browser', intent=favInt
+      % "mobi.mgeek.TunnyBrowser/.SplashActivity",
+      iconResource="mobi.mgeek.TunnyBrowser/.SplashActivity"),
+    favorite(_id=13, cellX=1.0, title='Maps', intent=favInt
+      % "com.generalmagic.magicearth/com.generalmagic.android.map.MapActivity;l.profile=0",
+      iconResource="com.generalmagic.magicearth/com.generalmagic.android.map.MapActivity"),
+    favorite(_id=14, cellX=2.0, title='riboVideo', intent=favInt % "ribo.vp/.VPcontrol",
+      iconResource="ribo.vp/.VPcontrol")
+  ],
   # Remove the 'Google' and 'Create' folder icons, and the side Google search bar
-  resp = dbCmd(ldb, "delete from favorites where title='Google'")
-  print(resp)
-  resp = dbCmd(ldb, "delete from favorites where title='Create'")
-  print(resp)
-  resp = dbCmd(ldb, "delete from favorites where spanX=5.0")  # The Google search bar, no title
-  print(resp)
+  delete = [["title", "Google"], ["title", "Create"],
+    ["spanX", 5.0]]  # (The Google search bar, no title)
+)
+
+
+def sameVal(aa, bb):
+  '''Is a value read from the database (a str) the same as a value we'd write?'''
+  if aa==None:
+    return bb==None
+  if str(aa)==str(bb):
+    return True
+  try:
+    return float(aa)==float(bb)  # ie '1.0' and 1
+  except (TypeError, ValueError):
+    return False
+
+
+def launcherChanges(rows, profile=launcherProfile):
+  '''Return a sqlBatch with just the changes needed to make the favorites table, 'rows'
+  (as dbGetRows returns them), match 'profile'
+  '''
+  bat = sqlBatch(launcherDb)
+  for col, val in profile.delete:
+    if [row for row in rows if sameVal(row.get(col), val)]:
+      bat.add("delete from favorites where %s=%s" % (col, sqlVal(val)))
+      rows = [row for row in rows if not sameVal(row.get(col), val)]
+
+  def update(row, vals):
+    diff = bunch()
+    for nm in vals:
+      if not sameVal(row.get(nm), vals[nm]):
+        diff[nm] = vals[nm]
+    if diff:
+      bat.setCells("favorites", "_id", int(row._id), diff)
+
+  for col, val, vals in profile.update:
+    for row in rows:
+      if sameVal(row.get(col), val):
+        update(row, vals)
+  for fav in profile.rows:
+    found = [row for row in rows if sameVal(row.get("_id"), fav._id)]
+    if found:
+      update(found[0], fav)
+    else:
+      bat.addRow("favorites", fav)
+  return bat
+
+
+def initLauncher():
+  '''Make the Nova Launcher's favorites match launcherProfile.  The table is read once,
+  and only the rows that differ are changed (in one transaction).  The launcher is
+  restarted only if they all were, if nothing needed changing, or if a change failed
+  (and so nothing was changed, see sqlBatch.run), it is left alone.
+  '''
+  rows = dbGetRows(launcherDb, "favorites")
+  if rows==None:
+    logp("  !! can't read the launcher's favorites")
+    return False
+  bat = launcherChanges(rows)
+  if len(bat.stmts)==0:
+    logp("  (launcher favorites are already set up)")
+    return True
+
+  print("\nUpdate the launcher's favorites ("+str(len(bat.stmts))+" changes)")
+  res = bat.run()
+  for rr in res or []:
+    print("-- "+rr.sql+"; -- "+(rr.error or str(rr.changes)+" rows"))
+  if res==None or [rr for rr in res if rr.error!=None]:
+    logp("  !! the launcher's favorites were not updated, not restarting it")
+    return False
 
   # Restart the Nova Launcher so it reads the updated database
   logp("  Killing com.teslacoilsw.launcher... to restart it")
   executeAdb("shell am force-stop com.teslacoilsw.launcher")
   logp("Restarting com.teslacoilsw.launcher")
   executeAdb("shell am start com.teslacoilsw.launcher")
+  return True
  
 
 def btest():
@@ -0,0 +1,117 @@
+'''fileHash -- md5 digests of files, computed in-process (rather than by running the
+  'md5' program) and remembered in the fileHash.cache file.  A file is only read again
+  when its path, size, modification time or inode changes.
+'''
+
+import sys, os, hashlib, json, threading, atexit
+from multiprocessing.pool import ThreadPool
+from ribou import *
+
+cacheFid = "fileHash.cache"
+chunkSize = 1024*1024  # Files are read and hashed in 1MB pieces
+
+_cache = None  # {absolute file path: [size, mtime, inode, md5]}, loaded on first use
+_cacheFid = None  # (The absolute path, set when the cache is loaded)
+_dirty = False
+_lock = threading.Lock()
+
+
+def md5Data(data):
+  return hashlib.md5(data).hexdigest()
+
+
+def md5Stream(fp, limit=None):
+  '''Return the md5 hex digest of what can be read from an open (binary) file, or just
+  of the first 'limit' bytes
+  '''
+  md5 = hashlib.md5()
+  while limit==None or limit>0:
+    data = fp.read(chunkSize if limit==None else min(chunkSize, limit))
+    if len(data)==0:
+      break
+    md5.update(data)
+    if limit!=None:
+      limit -= len(data)
+  return md5.hexdigest()
+
+
+def md5File(fid, limit=None):
+  '''Return the md5 hex digest of a file (or of just its first 'limit' bytes), from the
+  cache if the file hasn't changed
+  '''
+  global _dirty
+  st = os.stat(fid)
+  key = os.path.abspath(fid)+("" if limit==None else "#"+str(limit))
+  sig = [st.st_size, st.st_mtime, st.st_ino]
+  with _lock:
+    ent = _loadCache().get(key)
+  if ent and ent[:3]==sig:
+    return str(ent[3])  # (json gives unicode on python 2)
+
+  with open(fid, 'rb') as fp:
+    md5 = md5Stream(fp, limit)
+  with _lock:
+    _cache[key] = sig+[md5]
+    _dirty = True
+  return md5
+
+
+def remember(fid, md5):
+  '''Record the md5 of a file we just wrote (ie hashed while it was being written) so it
+  need not be read again
+  '''
+  global _dirty
+  st = os.stat(fid)
+  with _lock:
+    _loadCache()[os.path.abspath(fid)] = [st.st_size, st.st_mtime, st.st_ino, md5]
+    _dirty = True
+
+
+def md5Tree(dir, threads=4):
+  '''Return a bunch of {relative path: md5} for all the files under 'dir', hashing
+  them on a pool of 'threads' threads.  (hashlib releases the GIL on big buffers.)
+  '''
+  fids = []
+  for path, dirs, fns in os.walk(dir):
+    for fn in fns:
+      fid = os.path.join(path, fn)
+      if os.path.isfile(fid):
+        fids.append(fid)
+
+  pool = ThreadPool(threads)
+  try:
+    md5s = pool.map(md5File, fids)
+  finally:
+    pool.close()
+  res = bunch()
+  for fid, md5 in zip(fids, md5s):
+    res[os.path.relpath(fid, dir).replace('\\', '/')] = md5
+  return res
+
+
+def _loadCache():
+  global _cache, _cacheFid
+  if _cache==None:
+    _cache = {}
+    _cacheFid = os.path.abspath(cacheFid)
+    try:
+      _cache = json.loads(readFile(_cacheFid))
+    except (IOError, OSError, ValueError):
+      pass  # No cache yet (or it was damaged), start a new one
+  return _cache
+
+
+def saveCache():
+  '''Write the cache back to disk if it changed (done automatically at exit)'''
+  global _dirty
+  with _lock:
+    if not _dirty:
+      return
+    tmpFid = _cacheFid+".tmp"
+    writeFile(tmpFid, json.dumps(_cache))
+    if os.path.isfile(_cacheFid):
+      os.remove(_cacheFid)  # (Windows won't rename over an existing file)
+    os.rename(tmpFid, _cacheFid)
+    _dirty = False
+
+atexit.register(saveCache)
@@ -2,177 +2,37 @@
 ''''packBoot -- unpack an Android boot.img to a kernel file and unpacked ramdisk --
 repack the ramdisk directory back into a ramdisk and pack with kernel
 @author: ribo
+
+(The work is done in-process by bootImg.py, this is the command line interface to it.)
+
+  packBoot.py unpack|pack [<filename>] [serial=<serial>]
+serial= works on the file in that device's reviveMC74 workspace, rmcWork/<serial>
+(serial=<host>:<port> for a network device, rmcWork/<host>_<port>).
 '''
-import sys, os, time, subprocess, shutil, traceback
-# In reviveMC74.py, packBoot.py is called from with the installFiles directory
-# ribou.py is the cwd (parent of installFiles, add cwd to path
+import sys, os, time, traceback
+# packBoot.py is in the installFiles directory, ribou.py and bootImg.py are in
+# its parent (usually also the cwd), add both to path
 sys.path.append(os.getcwd())
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from ribou import *
-from datetime import datetime
+import bootImg
+from examImg import workspace
 
 
-def unpack(biFn):
-  '''Unpack a boot image file
+def unpack(biFn, serial=None):
+  '''Unpack a boot image file (in device 'serial's workspace, if given)
   '''
-  try:
-    fn, ext = biFn.split('.')
-  except: fn = biFn
-  unDir = fn+"Unpack"
-  try:
-    shutil.rmtree(unDir)
-  except:
-    pass  # Directory may exist
-  os.mkdir(unDir)
-  os.chdir(unDir)
-  print("cwd "+os.getcwd())
+  return bootImg.unpackImg(workspace(biFn, serial))
 
-  resp, rc = execute("unpackbootimg -i ../"+biFn)
-  print("unpackbootimg "+biFn+": (rc="+str(rc)+") resp:\n"+prefix("  |", resp))
-  if rc==1:
-    print("  (This partition img was probably not a boot partition.)")
-    os.chdir("..")  # Didn't unpack, back out and remove ..Unpack dir
-    try:
-      shutil.rmtree(unDir)
-    except:
-      pass  # Directory may exist
-    return False
-
-  # Remove the 'rmcBoot.imgRaw-' prefix from all the file names
-  for ff in listDir('.', False):
-    newFn = ff.split('-', 1)[1]
-    shutil.move(ff, newFn)
-
-  print("ls-unpack "+os.getcwd()+":\n"+prefix("--|", '\n'.join(listDir('.',
-    False))))
-
-  # On linux, unpackbootimg may return a ramdisk file, rather than ramdisk.gz
-  if os.path.isfile("ramdisk.gz")==False:
-    if os.path.isfile("ramdisk"):
-      shutil.move("ramdisk", "ramdisk.gz")
-      print("  renamed 'ramdisk' to 'ramdisk.gz'")
-    else:
-      print("!!No ramdisk file found after unpackbootimg.")
-      return
 
-  # Also, on linux (version of) unpackbootimg, it seems to use the filename
-  # 'kernel' rather than 'zImage', rename to 'zImage'
-  if os.path.isfile("zImage")==False:
-    if os.path.isfile("kernel"):
-      shutil.move("kernel", "zImage")
-    else:
-      print("!!No kernel/zImage file after unpackbootimg.")
-      return
-
-  resp, rc = execute("gunzip ramdisk.gz")
-  print("gunzip ramdisk.gz: "+str(rc)+"\n"+resp)
-  rd = readFile("ramdisk", ascii=False)
-  print("ramdisk "+str(len(rd))+" bytes")
-  lsRdOrig, rc = execu("cpio -i -tv", rd)
-  #writeFile("../"+fn+"LsRdOrig", lsRdOrig)
-  #print(lsRdOrig)
-  #import pdb; pdb.set_trace()
-
-  os.chdir("..")
-  rdDir = fn+"Ramdisk"
-  try:
-    shutil.rmtree(rdDir)
-  except:
-    pass
-  os.mkdir(rdDir)
-  os.chdir(rdDir)
-  print("cwd rd "+os.getcwd())
-  
-  resp, rc = execu("cpio -i -m", rd)
-    # -m is preservce file modification time
-  print("cpio -i <ramdisk: "+str(rc)+"\n"+resp)
-  
-
-def pack(biFn):
+def pack(biFn, serial=None):
   '''Pack a bootRamdisk dir back into a ramdisk, and build an image file
      from booUnpack dir
   '''
+  biFn = workspace(biFn, serial)
   print("pack: "+biFn)
-  try:
-    fn, ext = biFn.split('.')
-  except: fn = biFn
-  unDir = fn+"Unpack"
-  rdDir = fn+"Ramdisk"
-
-  # In bootRamdisk dir, recreate the cpio archive
-  os.chdir(rdDir)
-  print("  cwd rd "+os.getcwd())
-
-  fl = listDir('.')
-  fl.sort()   # Sort filenames alphabetically
-  fList = ""
-  for ff in fl:
-    if len(ff)>2:  # Remove blank lines and './'
-      fList += ff[2:]+"\n"
-  
-  pr(fList)
-
-  outFid = "../"+unDir+"/ramdisk"
-  rd, rc = execu("cpio -o -H newc -R 0.0 -F "+outFid, fList, showErr=False,
-    returnStr=False)
-  print("cpio -o  rc="+str(rc)+", "+str(os.path.getsize(outFid))+" bytes")
-
-
-  # In the bootUnpack directory, write the ramdisk file and gzip it
-  os.chdir("../"+unDir)
-  print("ls-pack "+os.getcwd()+":\n"+prefix("--|", '\n'.join(listDir(os.getcwd(),
-    False))))
-  #try:
-  #  os.remove("ramdisk")
-  #except: pass
-  #writeFile("ramdisk", rd)
-  #lsRdNew, rc = execute("cpio -tv -I ramdisk")
-
-
-  # Compress ramdisk
-  try:
-    os.remove("ramdisk.gz")
-  except: pass
-  resp, rc = execute("gzip ramdisk")
-  print(" ramdisk gzipped "+str(rc))
-
-
-  # Build file system image file
-  cmdline = removeCRLF(readFile("cmdline"))
-  base = removeCRLF(readFile("base"))
-  if base[:2]!= '0x':
-    base = '0x'+base
-  pagesize = removeCRLF(readFile("pagesize"))
-  ts = datetime.now().strftime("%y%m%d%H%M")
-  cmd = ["mkbootimg", "--kernel", "zImage",
-    "--ramdisk", "ramdisk.gz", "--cmdline", cmdline,
-    "--base", base, "--pagesize", pagesize, "--output", "../"+biFn+ts ]
-  # Note: --cmdline contains spaces, we must pass the command as tokens so
-  # execute() won't .split(' ') the command to prepare the args array
-  print("cmd: '"+str(cmd)+"'")
-  resp, rc = execute(cmd)
-  print("(rc="+str(rc)+") resp:\n"+prefix("  |", resp))
-
-  os.chdir("..")
-  #writeFile(fn+"LsRdNew", lsRdNew)
-
-
-def listDir(dir, recursive=True, search=''):
-  # Replacement for 'find . -print' on Windows
-  lst = []
-  for fn in os.listdir(dir):
-    subdir = dir+'/'+fn
-    if search in subdir: 
-      lst.append(subdir)
-    if recursive and os.path.isdir(subdir):
-      lst.extend(listDir(subdir))
-  return lst
-
-
-def removeCRLF(ln):  # Remove all trailing LFs and CRs
-  while len(ln)>0 and ln[-1]=='\r' or ln[-1]=='\n':
-    ln = ln[:-1]
-  return ln
+  return bootImg.packImg(biFn)
 
 
 if __name__ == '__main__':
@@ -186,20 +46,20 @@ if __name__ == '__main__':
     else:
       op = sys.argv[1]
       args = []
+      opts = {}
       argList = sys.argv[2:]  # Remove the program name and pack/unpack mode token
       for arg in argList:
         if '=' in arg:
-          args.remove(arg)
-          arg = arg.split('=')  # Handle name=val arguments
-          locals()[arg[0]] = arg[1]  # Add name to locals
+          arg = arg.split('=', 1)  # Handle name=val arguments
+          opts[arg[0]] = arg[1]
         else:
           args.append(arg)
 
       biFn = args[0] if len(args)>0 else "boot.img"
       if op == 'pack':
-        pack(biFn)
+        pack(biFn, opts.get("serial"))
       else:
-        unpack(biFn)
+        unpack(biFn, opts.get("serial"))
   except Exception as ex:
     # (Do not use hndExcept, it reads from stdin, and would hang reviveMC74.py)
     print("packBoot exception: "+traceback.format_exc())
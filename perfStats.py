@@ -0,0 +1,75 @@
+'''perfStats -- Where the time goes.  When enabled (reviveMC74 -p), every command run
+  (adb, fastboot, etc), every adb server request, transfer and wait for the device is
+  recorded with the objective it was done for, and summary() shows the time spent per
+  objective, broken down by what it was doing.
+'''
+
+import threading
+
+enabled = False
+_recs = []  # [objective, kind, label, secs, bytesIn, bytesOut, spawnSecs]
+_lock = threading.Lock()
+
+
+def record(objective, kind, label, secs, bytesIn=0, bytesOut=0, spawn=0):
+  '''Record one operation.  'kind' is ie 'exec' (a program was run), 'adb' (done through
+  the adb server) or 'wait', 'label' says what (ie 'push'), 'spawn' is the time it took
+  to start the program.  Kind 'objective' records the whole time of an objective.
+  '''
+  if enabled:
+    with _lock:
+      _recs.append([objective or "(none)", kind, label, secs, bytesIn, bytesOut, spawn])
+
+
+def clear():
+  with _lock:
+    del _recs[:]
+
+
+def _bar(secs, total, width=30):
+  return '#'*int(round(width*secs/total)) if total>0 else ""
+
+
+def _kb(nn):
+  if nn<1024:
+    return "%dB" % nn
+  return "%.0fKB" % (nn/1024.0) if nn<1024*1024 else "%.1fMB" % (nn/1024.0/1024)
+
+
+def summary():
+  '''Return a report of the time spent in each objective, and within it, in each kind of
+  operation, biggest first
+  '''
+  with _lock:
+    recs = list(_recs)
+  objs = {}  # {objective: bunch of total and {kind label: [secs, calls, in, out, spawn]}}
+  for obj, kind, label, secs, bIn, bOut, spawn in recs:
+    ob = objs.setdefault(obj, dict(total=0.0, ops={}))
+    if kind=="objective":
+      ob["total"] += secs
+      continue
+    op = ob["ops"].setdefault(kind+' '+label, [0.0, 0, 0, 0, 0.0])
+    op[0] += secs
+    op[1] += 1
+    op[2] += bIn
+    op[3] += bOut
+    op[4] += spawn
+
+  for ob in objs.values():  # (Objectives not run by runObjective have no total)
+    ob["total"] = max(ob["total"], sum([op[0] for op in ob["ops"].values()]))
+  grand = sum([ob["total"] for ob in objs.values()])
+
+  lines = ["Time by objective:"]
+  for obj in sorted(objs, key=lambda nm: -objs[nm]["total"]):
+    ob = objs[obj]
+    lines.append("  %-24s %7.1fs  %s" % (obj, ob["total"], _bar(ob["total"], grand)))
+    other = ob["total"]
+    for nm in sorted(ob["ops"], key=lambda nm: -ob["ops"][nm][0]):
+      secs, calls, bIn, bOut, spawn = ob["ops"][nm]
+      other -= secs
+      xfer = (" in "+_kb(bIn) if bIn else "")+(" out "+_kb(bOut) if bOut else "")
+      lines.append("    %-22s %7.1fs %4d calls%s%s  %s" % (nm, secs, calls, xfer,
+        " (%.1fs starting programs)" % spawn if spawn>=0.05 else "", _bar(secs, grand)))
+    if other>=0.05:
+      lines.append("    %-22s %7.1fs  %s" % ("(other)", other, _bar(other, grand)))
+  return '\n'.join(lines)
@@ -16,9 +16,14 @@ the Meraki apps and to install reviveMC74.apk
 
 # python reviveMC74.py installApps host=phCom
 
-import sys, os, time, datetime, shutil
+import sys, os, time, datetime, shutil, threading, traceback, json
+from multiprocessing.pool import ThreadPool
 from ribou import *
 from examImg import * # Utilities for reviveMC74
+import bootImg  # Unpack/pack boot.img files and their ramdisks
+import fileHash  # md5 digests of files (cached)
+import adbClient  # Talks to the adb server directly, examImg.executeAdb uses it
+import perfStats  # Time spent per objective (-p option)
 
 installFilesDir = "installFiles"
 filesPresentFid = "filesPresent.flag"
@@ -28,12 +33,7 @@ neededProgs = bunch(  # These are commands that demonstrate that needed programs
   # PATH and that they execute (ie not just the filename of the program
   adb = ["adb version", "adbNeeded"],   
   fastboot = ["fastboot", "adbNeeded"],
-  unpackbootimg = ["unpackbootimg", "unpNeeded"],
-  mkbootimg = ["mkbootimg", "unpNeeded"],
-  chmod = ["chmod", "unpNeeded"], 
-  cpio = ["cpio", "unpNeeded"], 
-  gzip = ["gzip -V", "gzipNeeded"], 
-  gunzip = ["gunzip -V", "gzipNeeded"], 
+  # (unpackbootimg, mkbootimg, cpio and gzip are no longer needed, see bootImg.py)
 )
 
 neededFiles = bunch(
@@ -67,20 +67,48 @@ installAppsExtra = bunch(
 )
 
 
+goldenImgDir = os.path.abspath("goldenImg")  # Fixed boot images, see goldenImgFid
+bootPatches = [  # The edits fixPart makes to the boot ramdisk (see bootImg.py)
+  # ro.secure=0 to allow rooting, and adb over usb
+  bunch(file="default.prop", set=[["ro.secure", "0"], ["persist.meraki.usb_debug", "1"]],
+    clearMode=0o022),  # (init ignores /default.prop if it is writable by group/other)
+  # in /init.rc after 'symlink /system/etc /etc' insert symlink /storage/emulated/legacy/ssm /ssm
+  bunch(file="init.rc", insert=[["symlink /system/etc",
+    "    symlink /storage/emulated/legacy/ssm /ssm"]])
+]
+
+
 options = bunch(
   #sendOid=[None, 'o:', 'Name of object to send as body of command'],
   #sessionMode = [False, 's', 'Loop reading commands from stdin'],
   extra = [False, 'x', 'Install extra apps/files'],  # Private, not for general use
+  adbExe = [False, 'a', "Run the adb program for each command (not the adb server protocol)"],
+  profile = [False, 'p', "Print a summary of where the time went, per objective"],
   help = [False, '?', 'Print help info']
 )
 
-arg = bunch(  # Place to store args for objective funcs to use
+arg = threadBunch(  # Place to store args for objective funcs to use
   part = "both",  # Target partition to backup or fix/install, ie 'boot', 'both' or 'boot2'
 )
 sys.arg = arg  # Make it universal (not just global (to reviveMC74)) so examImg.executeAdb sees it
 # Options:
 #   part  -- specify which parition to read or write(flash) data to
 #   img   -- full filename of disk image to write/flash in flashPart objective
+#   serial -- adb/fastboot serial number of the device to use, if more than one is attached
+#   host  -- network address (host or host:port) of a revived MC74 to use, instead of USB
+#   goal  -- objective(s) the 'fleet' objective runs on each device (default 'revive'),
+#            ie goal=installApps,startPhone
+#   hosts -- 'fleet' works on these network MC74s rather than those on USB: the name of an
+#            inventory file (one host or host:port per line, '#' starts a comment), or a
+#            comma separated list of them
+#   workers -- max number of devices the 'fleet' objective works on at once
+#   timeout -- seconds the 'fleet' objective gives each device before giving up on it
+#            (its commands are stopped, and its worker waits up to fleetStopSecs for it)
+#   results -- file 'fleet' writes each device's results to (json)
+
+hostLock = threading.Lock()  # Serializes creation of shared host files in fleet runs
+fleetWorkers = 32  # Default max number of devices a fleet run works on at once
+fleetStopSecs = 30  # How long a fleet run waits for a device it gave up on to stop
 
 
 def reviveMain(args):
@@ -109,6 +137,9 @@ def reviveMain(args):
         print("Unrecognized option letter '"+tok[0]+"', ('"+tok+"')")
         return
 
+  adbClient.enabled = not options.adbExe[0]
+  perfStats.enabled = options.profile[0]
+
   if options.help[0]:  # If the -? option was given, display help info
     print(__doc__)
     for nn, vv in options.items():
@@ -137,9 +168,7 @@ def reviveMain(args):
   if 'host' in arg:
     resp, rc = executeAdb("shell getprop ro.serialno")
     if resp.find("error:") == 0:  # Resp probably: "error: device 'xxx:5555' not found\r\n"
-      if arg.host.find(':') == -1: arg.host += ":5555"
-      resp, rc = execute("adb connect "+arg.host)   # !Do not use executeAdb()
-      logp("  connecting to "+arg.host+": "+resp)
+      connectHost(arg.host)
 
   # Verify that the needed programs and files are/were present
   # if installedFilesDir is not local to the current directory, find it (only for developers)
@@ -173,23 +202,6 @@ def reviveMain(args):
           +" command we use to test.)"
         )
         
-      if "unpNeeded" in state.needed:
-        print("\nUNPACKBOOTIMG/MKBOOTIMG/CPIO/CHMOD programs needed.  To download, see:\n"
-          +"  https://forum.xda-developers.com/showthread.php?t=2073775\n"
-          +"  or: https://github.com/huaixzk/android_win_tool   for precompiled"
-          +" windows version\n"
-          +"  or: https://github.com/osm0sis/mkbootimg   for the source code.\n"
-          +"  Make sure that 'unpackbootimg', 'mkbootimg', 'chmod' and 'cpio' are in"
-          +" the 'path'."
-        )
-        
-      if "gzipNeeded" in state.needed:
-        print("\nGZIP/GUNZIP programs needed.  To for windows, see:\n"
-          +"  https://sourceforge.net/projects/unxutils/files/unxutils/current/UnxUtils.zip/download"
-          +"To get 'UnxUtil.zip.  From that file extract: 'usr/local/wbin/gunzip.exe' "
-          +"and 'usr/local/wbin/gzip.exe' to a directory that is in your PATH." 
-        )
-        
       return
 
   # Execute the target objective's 'func', it will call it's prerequisites
@@ -205,15 +217,17 @@ def reviveMain(args):
     return
 
   print(target+" Function: "+' '.join(args))  
-  log(target+' '.join(args)+"===================================================================", prefix="\n")
-  if func():
+  log(target+' '.join(args)+"===================================================================")
+  if runObjective(target):
     print("Acheived objective '"+target+"'")
   else:
     print(target+" failed:")
     for line in state.error:
       print("  --"+line)
 
-  log(rformat(state))  # Log the state of the operation on completion
+  log(rformat(state.current()))  # Log the state of the operation on completion
+  if options.profile[0]:
+    print('\n'+perfStats.summary())
 
 
 
@@ -240,19 +254,10 @@ def chkFile(fid):
 
 # FUNCTIONS FOR CARRYING OUT OBJECTIVES ----------------------------------------
 def reviveFunc():
+  '''(flashPart, installApps and startPhone, the prerequisites, do the work, see
+  objectiveDag)
+  '''
   logp("--(reviveFunc)") 
-  #if adbModeFunc("normal") == False:
-  if flashPartFunc()==False:
-    print("flashPartFunc failed")  
-    return False
-
-  if installAppsFunc()==False:
-    print("installAppsFunc failed")  
-    return False
-
-  if startPhoneFunc()==False:
-    print("startPhoneFunc failed")  
-    return False
   return True
 
 
@@ -263,10 +268,6 @@ def replaceRecoveryFunc():
   The CWM interface should show on the phone's display.
   '''
 
-  if state.adbMode != 'adb':
-    if adbModeFunc("adb")==False: 
-      return False
-
   # Has the recovery partition already been replaced?
   isReplaced = False
   resp, rc = executeAdbLog("shell grep secure default.prop")
@@ -300,7 +301,7 @@ def replaceRecoveryFunc():
       return False
 
     logp("  --Writng revovery partition image:  "+neededFiles.recoveryClockImg)
-    resp, rc = executeLog("fastboot flash recovery "+installFilesDir+"/"+neededFiles.recoveryClockImg)
+    resp, rc = executeFastbootLog("flash recovery "+installFilesDir+"/"+neededFiles.recoveryClockImg)
     # IF this hangs on Linux, the problem may be that 'fastboot devices'
     # returns 'no permissions  fastboot', meaning that the user needs to be root to write to 
     # the USB device.    Try doing the fastboot commands as root, ie with sudo?
@@ -321,13 +322,20 @@ def replaceRecoveryFunc():
       pass
 
     print("    --Rebooting")
-    resp, rc = executeLog("fastboot reboot")
+    resp, rc = executeFastbootLog("reboot")
     bootWaitLoop("adb")  # Wait for reboot to finish before letting backupPartFunc continue
 
   state.replaceRecovery = True
   return True
 
 
+def partImgId(partName):
+  '''Return the path, in the device's workspace, that a partition's files are named from,
+  ie <workspace>/rmcBoot for boot (rmcBoot.img, rmcBoot.imgRaw, rmcBootRamdisk ...)
+  '''
+  return workspace('rmc'+partName[:1].upper()+partName[1:])
+
+
 def backupPartFunc():
   '''Backup a disk partition from the MC74, defaults to the 'boot' partition.  If it is
   the boot or boot2 partition, it is then unpacked into the rmcBoot[2]Unpack and the
@@ -338,9 +346,6 @@ def backupPartFunc():
   Other partitions are backedup to rmcXXXX.img.
   '''
 
-  if replaceRecoveryFunc()==False:
-    return False
-
   # Verify that the adb connection is in root mode
   resp, rc = executeAdbLog("shell id")
   if resp.find("(root)")==-1:
@@ -355,18 +360,18 @@ def backupPartFunc():
     imgFn = arg.img
     makeOrig = False
   else:
-    imgFn = 'rmc'+partName[:1].upper()+partName[1:]+".img"
+    imgFn = partImgId(partName)+".img"
     makeOrig = True
   if partName[:4]=='boot':
     imgFn += "Raw"  # Backing up boot produces .imgRaw, fixPartFunc uses this to create .img
 
   logp("backupPart "+partName+" partition: "+partFid)
-  resp, rc = executeAdbLog("shell dd if="+partFid+" of=/cache/"+imgFn+" ibs=4096")
-  resp, rc = executeAdb("pull /cache/"+imgFn+" .")
-  resp, rc = executeAdbLog("shell rm /cache/"+imgFn)
+  # Stream the partition straight into imgFn, (no copy in /cache, so any size partition
+  # can be backed up)
+  pulled = streamPull(partFid, imgFn)
 
-  if os.path.isfile(imgFn)==False:
-    logp("!!Can't find "+imgFn+" after pulling it")
+  if os.path.isfile(imgFn)==False or pulled.size==0:
+    logp("!!Can't read "+partFid+" from the device")
     return False
 
   if partName[:4]!='boot':  # For non boot partitions we are done, success
@@ -377,9 +382,14 @@ def backupPartFunc():
     print("--"+imgFn+" file size is "+str(biSize)+", should be 8388608")
     return False
     
-  print("  --unpack "+imgFn+" and unpack the ramdisk")
-  resp, rc = executeLog(sys.executable+' '+installFilesDir+"/packBoot.py unpack "+imgFn)
-  # sys.executable is the name of the python interpreter we are running
+  if target!="backupPart" and os.path.isfile(goldenImgFid(imgFn)):
+    print("  --"+imgFn+" was fixed before, fixPart will use "+goldenImgFid(imgFn))
+    for dir in bootImg.imgDirs(imgFn):  # (Not another image's, if fixPart is run later)
+      shutil.rmtree(dir, True)
+  else:
+    print("  --unpack "+imgFn+" and unpack the ramdisk")
+    if bootImg.unpackImg(imgFn)==False:
+      logp("  !! "+imgFn+" could not be unpacked, it is not a boot image")
 
   if os.path.isfile(imgFn[:-3]+"Orig")==False:  # If no .imgOrig file, make it now
     # We should never overwrite this copy, the original copy from the phone
@@ -397,13 +407,7 @@ def fixPartFunc():
   partName = arg.part  # Get name of partition to backup, defaults to 'boot'
   if partName=="both":
     partName = "boot"
-  imgId = 'rmc'+partName[:1].upper()+partName[1:]
-  rawFid = imgId+".imgRaw" if partName=="boot" else imgId+".img"
-  rawImgExists = os.path.isfile(rawFid)
-
-  if rawImgExists==False:
-    if backupPartFunc()==False:
-      return False
+  imgId = partImgId(partName)
 
   if partName[:4]!="boot":  # Only the boot[2] partition needs to be 'fixed'
     return True
@@ -414,70 +418,80 @@ def fixPartFunc():
     # If this is an explicit request to fixPart, do it
 
   logp("fixPartFunc "+imgId+".imgRaw to make it rooted.")
-  try:
-    os.remove(imgId+'.img')
-  except:  pass
+  if target!="fixPart":  # (An explicit fixPart uses the Ramdisk directory, see below)
+    return goldenFix(imgId)
+  if os.path.isdir(imgId+"Ramdisk")==False:  # (backupPart found it in the golden cache)
+    bootImg.unpackImg(imgId+".imgRaw")
+
+  # (Files that are already fixed are not rewritten, so if nothing changed, packImg
+  # reuses the existing rmcBoot.img rather than building it again)
+
+  # Edit default.prop and init.rc (see bootPatches)
+  logp("  -- patch "+imgId+"Ramdisk: "+', '.join([pt.file for pt in bootPatches]))
+  fn = imgId+"Ramdisk/default.prop"
+  if os.path.isfile(fn)==False:
+    logp("  !! Can't find: "+fn+"\n  !! Rerun the 'fixPart' objective.")
+    try:
+      os.remove(imgId+'.img')  # (Don't leave an old image that revive would flash)
+    except:  pass
+    return False
+  for msg in bootImg.patchDir(imgId+"Ramdisk", bootPatches):
+    logp("  !! "+msg)
+  log("    fixed "+partName+" default.prop:\n"+prefix('__', readFile(fn)))
 
-  # Edit default.props, change 'ro.secure=1' to 'ro.secure=0'
-  # and: persist.meraki.usb_debug=0 to ...=1
-  logp("  -- edit default.prop to change ro.secure to = 0")
+  logp("  -- repack ramdisk, repack "+imgId+".img")
   try:
-    fn = imgId+"Ramdisk/default.prop"
-    prop = readFile(fn)
-    log("  default.prop:\n"+prefix('__', prop))
-
+    bootImg.packImg(imgId+".img", imgId+".img")
+  except Exception as ex:
+    state.error.append("fixPart: packing "+imgId+".img failed: "+str(ex))
     try:
-      ii = prop.index('secure=')+7
-      prop = prop[:ii]+'0'+prop[ii+1:] # Change '1' to '0'
-    except:  print("  --failed to find/replace 'secure=1'")
-    try:
-      ii = prop.index('usb_debug=')+10
-      prop = prop[:ii]+'1'+prop[ii+1:] # Change '0' to '1'
-    except:  print("  --failed to find/replace 'secure=1'")
-    #log("itermediate default.prop:\n"++prefix('--', prop))
-
-    # Remove \r from \r\n on windows systems
-    pp = []
-    for ln in prop.split('\n'):
-      if ln[-1:]=='\r':  ln = ln[:-1]
-      if len(ln)>0:
-        #print("      .."+ln)
-        pp.append(ln)
-    writeFile(imgId+"Ramdisk/default.prop", '\n'.join(pp))
-    # /default.prop will be ignored by system/core/init/init.c if writable by
-    # group/other
-    resp, rc = executeLog("chmod go-w "+imgId+"Ramdisk/default.prop")
-    log("    fixed "+partName+" default.prop:\n"+prefix('__', '\n'.join(pp)))
-  except IOError as err:
-    logp("  !! Can't find: "+fn+" in "+os.getcwd()+"\n  !! Rerun the 'fixPart' objective.")
+      os.remove(imgId+'.img')  # (Don't leave an old image that revive would flash)
+    except:  pass
     return False
+  log(prefix("  ..|", '\n'.join(listDir(workspace(), False, 'rmcBoot.img'))))
+  return True
 
-  # Add symlink to /ssm
-  # in /init.rc after 'symlink /system/etc /etc' insert symlink /storage/emulated/legacy/ssm /ssm
-  # in init.bcm911130_me1.rc after symlink.../sdcard  symlink /storage/emulated/legacy/ssm /ssm2
-  editFile(imgId+"Ramdisk/init.rc", "symlink /system/etc",
-    insert="    symlink /storage/emulated/legacy/ssm /ssm")
 
-  logp("  -- repack ramdisk, repack "+imgId+".img")
-  resp, rc = executeLog(sys.executable+' '+installFilesDir+"/packBoot.py pack "+imgId+".img")
-  # sys.executable is the name of the python interpreter we are running
-  #logp(prefix("  __|", '\n'.join(listDir(os.getcwd(), False, 'rmcBoot.img'))))
-  if os.path.isfile(imgId+".img"):  # Make sure no .img file, we will rename
-    hndExcept()
-  
+def goldenImgFid(rawFid):
+  '''Return the golden image cache file for boot image 'rawFid': the image fixPart makes
+  from it, named by the md5 of rawFid and the version of bootPatches.  Most MC74s have
+  the same stock boot image, so it need only be fixed once.
+  '''
+  return os.path.join(goldenImgDir, fileHash.md5File(rawFid)+'-'
+    +bootImg.patchVersion(bootPatches)+".img")
 
-  # Rename the new file, rmcBoot.img2xxxxxxxxxxx (2... is the first digit in decade timestamp)
-  for fid in os.listdir('.'):
-    if fid[:len(imgId)+5] == imgId+'.img2':
-      os.rename(fid, imgId+'.img')
-      break
-  log(prefix("  ..|", '\n'.join(listDir(os.getcwd(), False, 'rmcBoot.img'))))
 
-  if os.path.isfile(imgId+".img"):  # Did packBoot succeed in creating .img file?
+def goldenFix(imgId):
+  '''Make the fixed <imgId>.img from <imgId>.imgRaw, by copying it from the golden image
+  cache, or, if it isn't there, by applying bootPatches to the image in memory (without
+  unpacking it to the Ramdisk directory) and adding it to the cache.
+  '''
+  rawFid = imgId+".imgRaw"
+  cacheFid = goldenImgFid(rawFid)
+  if os.path.isfile(cacheFid):
+    logp("  -- "+imgId+".img from the golden image cache: "+cacheFid)
+    shutil.copy(cacheFid, imgId+".img")
     return True
-  else:
-    state.error.append("fixPart: Can't find file '"+imgId+".img' after packBoot returned.")
+
+  logp("  -- patch "+rawFid+": "+', '.join([pt.file for pt in bootPatches]))
+  try:
+    img, missing = bootImg.patchBootImg(readFile(rawFid, ascii=False), bootPatches)
+  except (IOError, ValueError) as ex:
+    state.error.append("fixPart: can't patch "+rawFid+": "+str(ex))
+    return False
+  for msg in missing:
+    logp("  !! "+msg)
+  if "default.prop: not found" in missing:
+    state.error.append("fixPart: "+rawFid+" has no default.prop")
     return False
+  bootImg.writeBin(imgId+".img", img)
+
+  if os.path.isdir(goldenImgDir)==False:
+    os.makedirs(goldenImgDir)
+  bootImg.writeBin(cacheFid+".tmp", img)
+  os.rename(cacheFid+".tmp", cacheFid)  # (Never a partly written image in the cache)
+  logp("  -- added "+cacheFid+" to the golden image cache")
+  return True
 
 
 def flashPartFunc():
@@ -495,150 +509,100 @@ def flashPartFunc():
   if 'img' in arg:
     imgFn = arg.img
   else:
-    imgFn = 'rmc'+partName[:1].upper()+partName[1:]+".img"
+    imgFn = partImgId(partName)+".img"
+
+  partFids = [partFid, partFid+'2'] if doBoth else [partFid]
 
   # If flashPart was not explicitly called, test to see if it has been done
   if target != "flashPart":
-    # Check timestamp of rmcBoot.img with copy stored in /data/boot.versionDate
+    # Compare the md5 of rmcBoot.img with what is on the partition(s) now
     if os.path.isfile(imgFn):
-      imgDt, imgTm, imgSz = fileDtTm(imgFn)  # Get timestamp of the local boot.img
-      print("    local "+imgFn+" timestamp: "+imgDt+' '+imgTm+' '+str(imgSz))
-      resp, rc = executeAdbLog("shell mount /data")
-      resp, rc = executeAdb("pull /data/"+partName+".versionDate .")
-      try:
-        vDate = readFile(partName+".versionDate").split(' ')
-        instDt, instTm, instSz = vDate[:3]
-        print("    remote "+partName+".versionDate timestamp: "+instDt+' '+instTm+' '+str(instSz))
-
-        if imgDt==instDt and imgTm==instTm:
-          logp("    ("+imgFn+" timestamp matches installed versionDate, skipping flash of "
-            +partName+")")
-          return True
-      except:
-        pass  # parname.versionDate file won't exist before recovery was installed, okay.
+      if partMatches(imgFn, partFids):
+        logp("    ("+imgFn+" md5 matches "+' and '.join(partFids)+", skipping flash of "
+          +partName+")")
+        return True
     else:
       pass  # rmcBoot.img doesn't exist, backupPar and fixPart etc need to be run...
 
-  # If the partition image file doesn't exist, run the fixPartFunc
-  if os.path.isfile(imgFn)==False and partName[:4]=='boot':
-    logp("    ("+imgFn+" not found, calling fixPart to create it)")
-    if fixPartFunc()==False:
-      return False
-
-  logp("  flashPartFunc, writing "+imgFn+" to "+partFid)
-  resp, rc = executeAdbLog("push "+imgFn+" /cache/"+imgFn)
-  if rc!=0:
-    state.error.append("Writing "+imgFn+" on device failed")
-    return False
-
-  resp, rc = executeAdbLog("shell dd if=/cache/"+imgFn+" of="+partFid
-    +" ibs=4096")
-  if rc!=0:
-    state.error.append("Copying "+imgFn+" on device, to "+partName+" failed")
+  logp("  flashPartFunc, writing "+imgFn+" to "+partFid+(" and "+partName+"2" if doBoth else ""))
+  if streamFlash(imgFn, partFids)==False:
+    state.error.append("Writing "+imgFn+" on device, to "+' and '.join(partFids)+" failed")
     return False
-  if doBoth:
-    resp, rc = executeAdbLog("shell dd if=/cache/"+imgFn+" of="+partFid+'2'
-      +" ibs=4096")
-    if rc!=0:
-      state.error.append("Copying "+imgFn+" on device, to "+partName+"2 failed")
-      return False
 
-  resp, rc = executeAdbLog("shell rm /cache/"+imgFn)
+  bat = shellBatch()
 
-  # Record timestamp and size of partition image file to allow for flashPart
-  # verification above
+  # Record timestamp, size and md5 of the partition image file (for people looking at
+  # the device, flashPart checks the partition itself, above)
   partDate = fileDtTm(imgFn) 
   try:
-    md5 = execute('md5 '+imgFn)[0].split()[0][:8]  # record part of the md5sum of the file
+    md5 = fileHash.md5File(imgFn)[:8]  # record part of the md5sum of the file
   except:
     md5 = "(noMD5)"
   partDate = partDate[0]+' '+partDate[1]+' '+str(partDate[2])+' '+imgFn+" "+md5
-  resp, rc = executeAdbLog("shell mount /data")
-  print("mount /data: %d %s" % (rc, resp))
-  resp, rc = executeAdbLog("shell echo "+partDate+" > /data/"+partName+".versionDate")
-  print("echo versiobDate: %d %s" % (rc, resp))
-  resp, rc = executeAdbLog("shell cat /data/"+partName+".versionDate")
-  print("versionDate readback: %d %s" % (rc, resp))
+  bat.add("mount /data")
+  bat.add("echo "+partDate+" > /data/"+partName+".versionDate")
+  bat.add("cat /data/"+partName+".versionDate")
   # Cause adbd to be started (as root) when it boots in normal mode
-  resp, rc = executeAdbLog("shell echo -n 1 >/data/property/persist.meraki.usb_debug")
-  logp("setting perist.meraki.usb_debug: %d %s" % (rc, resp))
-  resp, rc = executeAdbLog("shell sync")
-  resp, rc = executeAdbLog("shell umount /data")
+  bat.add("echo -n 1 >/data/property/persist.meraki.usb_debug")
+  bat.add("sync")
+  bat.add("umount /data")
+  res = bat.run()
+  print("versionDate readback: %d %s" % (res[2][1], res[2][0]))
+  logp("setting perist.meraki.usb_debug: %d %s" % (res[3][1], res[3][0]))
 
   return True
   
 
 def installAppsFunc():
-  if adbModeFunc("normal")==False:  # Get into normal operation
-    return False
-
   # TTD:  change telsacoilsw launcher DB
   if options.extra[0]:  # Was the -e option specified 
     # Add the extra files and apps to the install lists
     installFiles.update(installFilesExtra)
     installApps.update(installAppsExtra)
 
-  logp("installAppsFunc, uninstall dialer2, droidNode, droidNodeSystemSvc, if not already done")
-
-  # Uninstall apps.  Ignore errors where the file to remove is already not there.
-  resp, rc = executeAdbLog("shell rm /system/app/DroidNode.apk", ignore="No such file")
-  resp, rc = executeAdbLog("shell rm /system/app/DroidNodeSystemSvcs.apk",
-    ignore="No such file")
-  resp, rc = executeAdbLog("uninstall ribo.audtest", ignore="Failure")
-  resp, rc = executeAdbLog("uninstall package:com.meraki.dialer2", ignore="Failure")
-  resp, rc = executeAdbLog("shell rm /data/app/com.meraki.dialer2-2.apk",
-    ignore="No such file")
-
-  # Install programs
-  for id in installFiles:
+  # Install programs, just those that aren't on the device already (the shell commands
+  # that follow the pushes are done in one batch)
+  stale = staleFiles()
+  for id in stale:
     print("  --install file/program: "+id)
+  ok = True
+  for fid in pushFiles([[installFid(id), installFiles[id][1]+'/'+installFiles[id][0]]
+      for id in stale]):
+    state.error.append("Pushing "+fid+" failed")
+    ok = False
+  bat = shellBatch()
+  fixups = []
+  for id in installFiles:
     instFl = installFiles[id]
-    isExtra = id[0:5] == "EXTRA"
-    dir = installFilesDir
-    if isExtra:  # If this is an extra file, read it from the .../extra dir
-      dir += "/extra"
-    resp, rc = executeAdbLog("push "+dir+"/"+instFl[0]+" "+instFl[1]+'/'+instFl[0]) 
     if len(instFl)>2:  # If there is a fixup cmd, do it (usually chmod)
-      resp, rc = executeAdbLog("shell "+instFl[2]+" "+instFl[1]+'/'+instFl[0])
+      fixups.append(instFl[2]+" "+instFl[1]+'/'+instFl[0])
+      bat.add(fixups[-1])
 
-  # Replace click with sockSvr to disable Mtunnel, first save a backup
-  resp, rc = executeAdb("shell ls /system/bin/clickOrig")
-  if resp.find("No such file")>0:
-    resp, rc = executeAdbLog("shell mv /system/bin/click /system/bin/clickOrig")
-  resp, rc = executeAdbLog("shell ln -s /system/bin/sockSvr /system/bin/click",
-    ignore="File exists")
+  logp("installAppsFunc, uninstall dialer2, droidNode, droidNodeSystemSvc, if not already done")
 
-  # Install/update new apps
-  for id in installApps:
-    fid = installApps[id][0]
-    appTag = installApps[id][1]
-
-    isExtra = id[0:5] == "EXTRA"
-    dir = installFilesDir
-    if isExtra:  # If this is an extra file, read it from the .../extra dir
-      dir += "/extra"
-
-    newDt, newTm, newSz = fileDtTm(dir+"/"+fid)
-
-    # If app is already installed see if we have a newer version
-    doInstall = True
-    instDt, instTm, instSz = remoteFileDtTm("/data/app/"+appTag+"*", appTag)
-    if instDt != None:
-      logp("    installed copy of "+id+":   "+instDt+" "+instTm+"  size: "+str(instSz))
-      # Is the installed apk, instDt the same or new?
-      if newDt<=instDt and newSz==instSz:
-        logp("    (Installed version of "+id+" is good, skipping install. (new "
-          +newDt+' '+str(newSz)+")")
-        doInstall = False
-     
-    if doInstall:
-      logp("  --installing app: "+id+"     ("+newDt+' '+newTm+' '+str(newSz)+")")
-      resp, rc = executeAdbLog("install -t -r "+dir+"/"+fid)
-  
+  # Uninstall apps.  Ignore errors where the file to remove is already not there.
+  bat.add("rm /system/app/DroidNode.apk", ignore="No such file")
+  bat.add("rm /system/app/DroidNodeSystemSvcs.apk", ignore="No such file")
+  bat.add("pm uninstall ribo.audtest", ignore="Failure")
+  bat.add("pm uninstall package:com.meraki.dialer2", ignore="Failure")
+  bat.add("rm /data/app/com.meraki.dialer2-2.apk", ignore="No such file")
+
+  # Replace click with sockSvr to disable Mtunnel, first save a backup
+  bat.add("[ -e /system/bin/clickOrig ] || mv /system/bin/click /system/bin/clickOrig")
+  bat.add("ln -s /system/bin/sockSvr /system/bin/click", ignore="File exists")
 
   # Make the shell prompt something short, edit file is used by /system/etc/mkshrc
-  resp, rc = executeAdb("shell rm /sdcard/SHELL_PROMPT")
-  resp, rc = executeAdb("shell touch /sdcard/SHELL_PROMPT")
+  bat.add("rm /sdcard/SHELL_PROMPT", ignore="No such file")
+  bat.add("touch /sdcard/SHELL_PROMPT")
+  res = bat.run()
+  for cmd, rr in zip(fixups, res):
+    if rr[1]!=0:
+      state.error.append("'"+cmd+"' failed: "+rr[0].strip())
+      ok = False
+
+  # Install/update new apps
+  if installAppList(staleApps())==False:
+    return False
 
 
   if options.extra[0]:  # Do extra install stuff (not for general users)
@@ -647,7 +611,9 @@ def installAppsFunc():
 
 
   # Change Nova Launcher favorites db to make Phone connect to reviveMC74, add icons
-  initLauncher()
+  launcherOk = initLauncher()
+  if launcherOk==False:
+    state.error.append("Updating the launcher's favorites failed")
 
 
   # Record the eth0 mac address
@@ -658,10 +624,134 @@ def installAppsFunc():
   state.mac = resp.strip().split(' ')[1]
   print("  (mac "+state.mac+")");
   
+  if launcherOk==False or not ok:
+    return False
   state.installApps = True
   return True
 
 
+def installFid(id):
+  '''Return the local file name of a file in installFiles'''
+  dir = installFilesDir
+  if id[0:5] == "EXTRA":  # If this is an extra file, read it from the .../extra dir
+    dir += "/extra"
+  return dir+"/"+installFiles[id][0]
+
+
+def staleFiles():
+  '''Return the ids of the files in installFiles that are not on the device, or are not
+  the same (by md5) as ours.  The device hashes them all with one md5sum.
+  '''
+  files = [[id, installFiles[id][1]+'/'+installFiles[id][0]] for id in installFiles]
+  resp, rc = executeAdb("shell md5sum "+' '.join([fl[1] for fl in files])+" 2>/dev/null")
+  devMd5 = []  # [[path, md5], ...]  (Missing files just aren't listed)
+  for ln in linesToList(resp):
+    md5 = parseMd5(ln)
+    if md5:
+      devMd5.append([ln.split()[-1], md5])
+
+  stale = []
+  for id, fid in files:
+    md5 = fileHash.md5File(installFid(id))
+    if md5 in [dm[1] for dm in devMd5 if dm[0].endswith(fid)]:
+      logp("    ("+fid+" is the same as "+id+", md5 "+md5+", skipping it)")
+    else:
+      stale.append(id)
+  return stale
+
+
+def appFid(id):
+  '''Return the local file name of an app in installApps'''
+  dir = installFilesDir
+  if id[0:5] == "EXTRA":  # If this is an extra app, read it from the .../extra dir
+    dir += "/extra"
+  return dir+"/"+installApps[id][0]
+
+
+def staleApps():
+  '''Return the ids of the apps in installApps that are not installed, or whose installed
+  .apk is not the same (by md5) as ours.  The package list and the md5s of the installed
+  .apk's come from the device in one batch.
+  '''
+  bat = shellBatch(log=False)
+  bat.add("pm list packages -f")
+  for id in installApps:
+    bat.add("md5sum /data/app/"+installApps[id][1]+"-*.apk")
+  res = bat.run()
+
+  # 'pm list packages -f' lines look like: package:/data/app/ribo.ssm-1.apk=ribo.ssm
+  instApk = {}  # {package name: installed .apk path}
+  for ln in linesToList(res[0][0]):
+    if ln.startswith("package:") and '=' in ln:
+      apk, pkg = ln[8:].rsplit('=', 1)
+      instApk[pkg] = apk
+  instMd5 = {}  # {installed .apk file name: md5}
+  for resp, rc in res[1:]:
+    for ln in linesToList(resp):
+      md5 = parseMd5(ln)
+      if md5:
+        instMd5[ln.split()[-1].split('/')[-1]] = md5
+
+  stale = []
+  for id in installApps:
+    md5 = fileHash.md5File(appFid(id))
+    apk = instApk.get(installApps[id][1])
+    apkMd5 = instMd5.get(apk.split('/')[-1]) if apk else None
+    if apkMd5==md5:
+      logp("    (Installed "+apk+" is the same as "+id+", md5 "+md5+", skipping install)")
+    else:
+      logp("    "+id+(" installed as "+apk+" (md5 "+str(apkMd5)+")" if apk
+        else " not installed")+", new md5 "+md5)
+      stale.append(id)
+  return stale
+
+
+def installAppList(ids, workers=4):
+  '''Install apps: push all the .apk's to /data/local/tmp at once (each on its own sync
+  connection, resumably, see xferPush), then 'pm install' them one after another, and
+  remove the copies.  If the device drops out, it takes every push with it, so then
+  they all stop and the ones not done yet are finished one at a time (each picking up
+  where it left off, with its own xferRetries).
+  '''
+  if len(ids)==0:
+    return True
+  devArg, devState = arg.current(), state.current()
+  objective = getattr(logCtx, "objective", None)
+  def pushApp(id):
+    arg.bind(devArg)  # (So the pool thread talks to, and logs for, this device)
+    state.bind(devState)
+    logCtx.objective = objective
+    return xferPush(appFid(id), "/data/local/tmp/"+installApps[id][1]+".apk", retries=0)
+
+  pool = ThreadPool(min(workers, len(ids)))
+  try:
+    pushed = pool.map(pushApp, ids)
+  finally:
+    pool.close()
+  if False in pushed:
+    logp("  --the device dropped out, pushing the rest of the apps one at a time")
+    pushed = [done or xferPush(appFid(id), "/data/local/tmp/"+installApps[id][1]+".apk")
+      for id, done in zip(ids, pushed)]
+
+  ok = True
+  bat = shellBatch()
+  for id, done in zip(ids, pushed):
+    tmpFid = "/data/local/tmp/"+installApps[id][1]+".apk"
+    if not done:
+      state.error.append("Pushing "+appFid(id)+" failed")
+      ok = False
+      continue
+    logp("  --installing app: "+id)
+    bat.add("pm install -t -r "+tmpFid)
+    bat.add("rm "+tmpFid)
+  res = bat.run()
+  for ii in range(0, len(res), 2):
+    if "Success" not in res[ii][0]:
+      state.error.append("pm install failed: "+res[ii][0].strip())
+      ok = False
+  return ok
+
+
 def checkFilesFunc():
   succeeded = True 
 
@@ -681,6 +771,17 @@ def checkFilesFunc():
   return succeeded
  
 
+# The devTracker states a device can be in for each adbModeFunc targetMode
+modeStates = bunch(adb=["recovery", "device"], normal=["device"], recovery=["recovery"],
+  fastboot=["fastboot"])
+
+def inMode(targetMode):
+  '''Is the device in 'targetMode' now?  (Asks the devTracker, state.adbMode may be out
+  of date: the device may have rebooted, or lost its cable, since it was set.)
+  '''
+  return deviceTracker().state(devSerial())[1] in modeStates.get(targetMode, [])
+
+
 def adbModeFunc(targetMode="adb"):
   '''Instruct user how to get MC74 in adb mode.
   
@@ -694,25 +795,21 @@ def adbModeFunc(targetMode="adb"):
  
   # Figure out what mode we are currently in
   currentMode = "unknown"
-  resp, rc = executeLog("adb devices")
-  if findLine(resp, "\trecovery"):
+  serialNo, devState = deviceTracker().state(devSerial())
+  if devState=="recovery":
     currentMode = "recovery"
     isAdb = True
-  if findLine(resp, "\tdevice"):
+  if devState=="device":
     currentMode = "normal"
     isNormal = True
     isAdb = True  # Normal mode (after fixing) should also adb enabled.
-  else:
-    resp, rc = executeLog("fastboot devices")
-    ln = findLine(resp, "\tfastboot")
-    if ln:
-      currentMode = "fastboot"
-      state.serialNo = ln.split('\t')[0]
-      # Note: state.serialNo may be 'no permissions' if in Linux and not root!
-      if targetMode=="fastboot":  # We are in fastboot, and that is the target mode
-        state.adbMode = "fastboot"
-        return True
-      isFastboot = True
+  elif devState=="fastboot":
+    currentMode = "fastboot"
+    state.serialNo = serialNo
+    if targetMode=="fastboot":  # We are in fastboot, and that is the target mode
+      state.adbMode = "fastboot"
+      return True
+    isFastboot = True
   
   logp("  --adbModeFunc, currentMode: "+currentMode+", targetMode: "+targetMode
     +(" adb" if isAdb else "")+(" normal" if isNormal else "")
@@ -723,7 +820,7 @@ def adbModeFunc(targetMode="adb"):
   
   elif isAdb and targetMode=="fastboot":
     print("    --Changing from adb mode to fastboot mode")
-    resp, rc = executeLog("adb reboot bootloader")
+    resp, rc = executeAdbLog("reboot bootloader")
   
   elif isAdb and targetMode=="adb":
     currentMode = targetMode  # normal mode should be eqivalent to adb after fixing
@@ -754,14 +851,14 @@ def adbModeFunc(targetMode="adb"):
   elif isNormal==False and targetMode=="normal":
     print("    --Changing from "+currentMode+" mode to normal device mode")
     if isFastboot:
-      resp, rc = executeLog("fastboot reboot")
+      resp, rc = executeFastbootLog("reboot")
       
     else:
       #resp, rc = executeLog("adb reboot")  --This seems to hang in clockwork recovery mode
       # Per https://opensource.com/article/19/7/reboot-linux  reboot can be forced with:
       #   echo b > /proc/sysrq-trigger
       # (if /proc/sys/kernel/sysrq is set to '1', which seems to be the case in clockwork recovery)
-      resp, rc = executeLog(['adb', 'shell', "echo b >/proc/sysrq-trigger"])
+      resp, rc = executeAdbLog(['shell', "echo b >/proc/sysrq-trigger"])
       log("reboot by sysrq, rc="+str(rc)+": "+resp)
     
   else:
@@ -777,24 +874,23 @@ def adbModeFunc(targetMode="adb"):
 
 
 def bootWaitLoop(tMode):
-  '''Loop for a while waiting for the MC74 to finish booting into fastboot or adb mode
+  '''Wait for the MC74 to finish booting into fastboot or adb mode, up to 'bootWait='
+  seconds (default 60)
   '''
-  cmd = "fastboot" if tMode=="fastboot" else "adb"
-  print("  --loop running '"+cmd+" devices' until we see a device")
-  searchStr = "\trecovery" if tMode=='adb' else "\tfastboot"
-  if tMode == "normal":   searchStr = "\tdevice"
-
-  for ii in range(0, 12):
-    resp, rc = executeLog(cmd+" devices")
-    ln = findLine(resp, searchStr)
-    if ln:
-      state.serialNo = ln.split('\t')[0]
-      print("      found device with serial number: "+state.serialNo)
-      state.adbMode = tMode
-      return True
+  devState = "fastboot" if tMode=="fastboot" else "recovery"
+  if tMode == "normal":   devState = "device"
+  timeout = float(arg.get("bootWait", 60))
+
+  print("  --waiting up to %d sec for the device to show up in %s mode" % (timeout, devState))
+  dev = deviceTracker().wait([devState], timeout, devSerial())
+  if dev:
+    state.serialNo = dev[0]
+    print("      found device with serial number: "+state.serialNo)
+    state.adbMode = tMode
+    return True
 
-    print("--Waiting for reboot "+str(12-ii)+"/12: "+resp.replace('\n', ' '))
-    time.sleep(5)
+  print("--Device didn't reboot into "+devState+" mode, it is: "
+    +str(deviceTracker().state(devSerial())[1]))
   state.adbMode = "unknown"
   return False
 
@@ -850,13 +946,11 @@ def versionFunc():
   
   iList = []
 
-  # Get the device serial number from u-boot-env partition
-  resp, rc = executeAdbLog("shell dd if=/dev/block/platform/sdhci.1/by-name/u-boot-env " \
-    "of=/cache/uBootEnv bs=640 count=1")
-  if rc==0:
-    resp, rc = executeAdbLog("pull /cache/uBootEnv uBootEnv.tmp")
-    resp, rc = executeAdbLog("shell rm /cache/uBootEnv")
-    ube = readFile("uBootEnv.tmp")
+  # Get the device serial number from (the first 640 bytes of) u-boot-env partition
+  ube = streamPull("/dev/block/platform/sdhci.1/by-name/u-boot-env", limit=640).data
+  if len(ube)>0:
+    if str!=bytes:
+      ube = ube.decode("ISO-8859-1")  # (python3)
     if len(ube)>5:  # Remove mysterious leading 5 bytes
       ube = ube[5:]
 
@@ -870,9 +964,6 @@ def versionFunc():
     for ln in ube:
       if len(ln)>3 and ln[:3]=='sn=':
         iList.append("devSN:\t"+ln[3:])
-    try:
-      os.remove("uBootEnv.tmp")
-    except:  pass
 
 
   # Get ro.build.version.release, ro.build.id, ro.build.date
@@ -909,7 +1000,7 @@ def versionFunc():
   for ln in iList:
     infoStr += "  "+ln+"\n"
   print("\nVersion Info:\n"+infoStr)
-  writeFile("version.info", infoStr)
+  writeFile(workspace("version.info"), infoStr)
   return True
 
 
@@ -937,7 +1028,7 @@ def pushFunc():
   except: 
     pass
 
-  os.chdir("/git/reviveMC74")
+  repoDir = "/git/reviveMC74"
   updateFiles = [
     '/andrStud/SSMservice/app/build/outputs/apk/debug/revive.SSMService-debug.apk',
     '/git/MC74/app/build/outputs/apk/debug/revive.MC74-debug.apk',
@@ -947,9 +1038,9 @@ def pushFunc():
     '/andrStud/hex/app/.cxx/cmake/debug/armeabi-v7a/sendevent'
   ]
   for fid in updateFiles:
-    shutil.copy2(fid, "installFiles")
+    shutil.copy2(fid, repoDir+"/installFiles")
 
-  resp, rc = execute('git status')
+  resp, rc = execute('git status', cwd=repoDir)
   print(resp)
   print("\nUse git add to add any new files to repo?, then press enter")
   try: 
@@ -960,26 +1051,352 @@ def pushFunc():
   except: 
     hndExcept()
 
-  resp, rc = execute('git commit -am "'+commitMsg+'"')
+  resp, rc = execute('git commit -am "'+commitMsg+'"', cwd=repoDir)
   print("Execute: git push")
 
 
+def fleetFunc():
+  '''Run the 'goal' objective(s) (default 'revive') on every MC74 attached to this
+  computer, or on every network MC74 in the 'hosts' inventory, up to 'workers' (default
+  fleetWorkers) at once.  Each device gets its own thread, with its own 'state' and 'arg'
+  bunches and its own reviveMC74-<serial>.log file.  A device still going after
+  'timeout' seconds is given up on (cancelDevice): its adb connections are shut down,
+  its fastboot command is killed, every adb or fastboot command its thread does from then
+  on fails (and, if on the network, it is disconnected).  Its worker keeps its slot until
+  the thread has stopped, so no more than 'workers' devices are worked on at once, and
+  none is still being written to when the results are summed up.  A thread that still
+  hasn't stopped after fleetStopSecs (ie it is waiting at a prompt) is abandoned: its
+  slot is freed and it is reported as ABANDONED.  The results are summed up at the end,
+  and written to the 'results' file if one is given.
+  '''
+  goals = arg.get("goal", "revive").split(',')
+  for goal in goals:
+    if goal=="fleet" or type(globals().get(goal+"Func")).__name__!='function':
+      state.error.append("fleet: unknown goal objective '"+goal+"'")
+      return False
+  goal = ','.join(goals)
+
+  if 'hosts' in arg:
+    devs = [[host, None] for host in readInventory(arg.hosts)]  # (Connected to when run)
+    if len(devs)==0:
+      state.error.append("fleet: no hosts in '"+arg.hosts+"'")
+      return False
+  else:
+    devs = listDevices()
+    if len(devs)==0:
+      state.error.append("fleet: no devices found by 'adb devices' or 'fastboot devices'")
+      return False
+  workers = int(arg.get("workers", min(len(devs), fleetWorkers)))
+  timeout = float(arg.get("timeout", 0))
+  logp("fleetFunc, running '"+goal+"' on "+str(len(devs))+" devices, "+str(workers)
+    +" at a time"+(", "+str(timeout)+" sec each" if timeout else "")+": "
+    +' '.join([dv[0] for dv in devs]))
+
+  fleetArg = bunch(**arg.current())  # Each device starts with a copy of the command line args
+  for nm in ['host', 'hosts']:
+    fleetArg.pop(nm, None)  # (The device's serial says which it is)
+  def runDevice(dev):
+    serial, mode = dev
+    devArg = bunch(**fleetArg)
+    devArg.serial = serial
+    devArg.tag = "["+serial+"] "
+    devArg.logFid = "reviveMC74-"+serial.replace(':', '_')+".log"
+    arg.bind(devArg)
+    state.bind(bunch(adbMode=None, error=[], needed=[], serialNo=serial))
+    startTm = time.time()
+    status = "ok"
+    try:
+      log(goal+" (fleet)===================================================================")
+      if mode==None and connectHost(serial)==None:
+        state.error.append("can't connect to "+serial)
+        status = "unreachable"
+      else:
+        for gl in goals:
+          if runObjective(gl)==False:
+            status = "FAILED"
+            break
+    except Exception as ex:
+      state.error.append(goal+" exception: "+traceback.format_exc())
+      status = "FAILED"
+    res = bunch(serial=serial, ok=status=="ok", status=status, errors=state.error,
+      elapsed=time.time()-startTm)
+    log(rformat(state.current()))
+    arg.bind(None)
+    state.bind(None)
+    return res
+
+  def runTimed(dev):
+    '''runDevice, but give up on the device after 'timeout' seconds, and wait (up to
+    fleetStopSecs) for its thread to stop (what it is in the middle of fails, and so does
+    anything after that)
+    '''
+    if not timeout:
+      return runDevice(dev)
+    done = []
+    th = threading.Thread(target=lambda: done.append(runDevice(dev)))
+    th.daemon = True
+    th.start()
+    startTm = time.time()
+    th.join(timeout)
+    if done:
+      return done[0]
+    serial = dev[0]
+    logp("  -- "+serial+": giving up after "+str(timeout)+" sec, waiting for it to stop")
+    cancelDevice(serial)
+    if dev[1]==None:
+      adbClient.execute("adb disconnect "+serial)
+    th.join(fleetStopSecs)
+    errors = ["gave up after "+str(timeout)+" sec"]
+    if th.is_alive():  # (It stays cancelled, so it can't do anything to the device)
+      logp("  !! "+serial+" didn't stop within "+str(fleetStopSecs)+" sec, abandoning it")
+      return bunch(serial=serial, ok=False, status="ABANDONED", elapsed=time.time()-startTm,
+        errors=errors+["didn't stop within "+str(fleetStopSecs)+" sec, abandoned"])
+    adbClient.cancelled.discard(serial)
+    return bunch(serial=serial, ok=False, status="TIMEOUT", elapsed=time.time()-startTm,
+      errors=errors)
+
+  startTm = time.time()
+  pool = ThreadPool(workers)
+  try:
+    results = pool.map(runTimed, [[hostSerial(dv[0]), dv[1]] if dv[1]==None else dv
+      for dv in devs])
+  finally:
+    pool.close()
+
+  counts = {}
+  for res in results:
+    counts[res.status] = counts.get(res.status, 0)+1
+  print("\nFleet results ("+goal+", %.0f sec, " % (time.time()-startTm)
+    +', '.join([str(counts[st])+" "+st for st in sorted(counts)])+"):")
+  for res in results:
+    print("  %-20s %-11s %5.0f sec" % (res.serial, res.status, res.elapsed))
+    for line in res.errors:
+      state.error.append(res.serial+": "+line)
+  if 'results' in arg:
+    with open(arg.results, 'w') as fp:
+      json.dump([dict(res) for res in results], fp, indent=1)
+    print("  (written to "+arg.results+")")
+  return all([res.ok for res in results])
+
+
+def hostSerial(host):
+  '''Return the adb serial of a network MC74, 'host:port' (port 5555 if not given)'''
+  return host if host.find(':')!=-1 else host+":5555"
+
+
+def connectHost(host):
+  '''Connect adb to a (revived) MC74 on the network, if it isn't already.  Returns its
+  serial ('host:port'), or None if it couldn't be reached.
+  '''
+  serial = hostSerial(host)
+  resp, rc = adbClient.execute("adb connect "+serial)  # !Not executeAdb(), no '-s'
+  logp("  connecting to "+serial+": "+resp.strip())
+  return serial if resp.find("connected to")!=-1 else None
+
+
+def readInventory(spec):
+  '''Return the list of hosts in the 'hosts' argument: an inventory file (one host or
+  host:port per line, '#' starts a comment) or a comma separated list'''
+  if os.path.isfile(spec):
+    hosts = []
+    for ln in readFile(spec).split('\n'):
+      tok = ln.split('#')[0].split()
+      if tok:
+        hosts.append(tok[0])
+    return hosts
+  return [host for host in spec.split(',') if host]
+
+
+def rawImgDone():
+  '''Has backupPart made the image file that fixPart works on?'''
+  partName = "boot" if arg.part=="both" else arg.part
+  imgId = partImgId(partName)
+  return os.path.isfile(imgId+".imgRaw" if partName=="boot" else imgId+".img")
+
+
+def partImgDone():
+  '''Is there an image file for flashPart to write?'''
+  partName = "boot" if arg.part=="both" else arg.part
+  if 'img' in arg or partName[:4]!='boot':
+    return True  # (Only boot images are made by fixPart)
+  return os.path.isfile(partImgId(partName)+".img")
+
+
+def recoveryInputs():
+  return dict(recovery=fileHash.md5File(installFilesDir+"/"+neededFiles.recoveryClockImg))
+
+
+def flashInputs():
+  partName = "boot" if arg.part=="both" else arg.part
+  imgFn = arg.img if 'img' in arg else partImgId(partName)+".img"
+  return dict(part=arg.part, img=fileHash.md5File(imgFn) if os.path.isfile(imgFn) else None)
+
+
+def appInputs():
+  inputs = dict(extra=options.extra[0])
+  lists = [installFiles, installApps]
+  if options.extra[0]:
+    lists += [installFilesExtra, installAppsExtra]
+  for lst in lists:
+    for id in lst:
+      dir = installFilesDir+("/extra" if id[0:5]=="EXTRA" else "")
+      inputs[id] = fileHash.md5File(dir+"/"+lst[id][0])
+  return inputs
+
+
+def journalSerial():
+  '''Serial number of the device, for its journal ("" if there isn't one)'''
+  return devSerial() or deviceTracker().state("")[0]
+
+
+def journalDone(nm, journal):
+  '''Is there a journal entry for objective 'nm' with the same inputs as now?'''
+  node = objectiveDag.get(nm, bunch())
+  if 'inputs' not in node or nm not in journal or 'fresh' in arg:
+    return False
+  try:
+    return journal[nm]==node.inputs()
+  except (IOError, OSError):
+    return False  # (An input file is missing, the objective will complain about it)
+
+
+def planObjective(name):
+  '''Return the list of objectives to do, in order, to achieve 'name'.  Prerequisites
+  whose 'done' function says they are already done are left out (with their own
+  prerequisites), 'name' itself is always done.
+  '''
+  plan = []
+  serial = journalSerial()
+  journal = readJournal(serial) if serial else {}
+  def visit(nm, isPrereq):
+    node = objectiveDag.get(nm, bunch())
+    if nm in plan:
+      return
+    if isPrereq and node.get('done') and node.done():
+      logp("  ("+nm+" is already done, skipping it)")
+      return
+    if isPrereq and journalDone(nm, journal):
+      logp("  ("+nm+" was done on "+serial+" with the same files, skipping it)")
+      return
+    for pre in node.get('needs', []):
+      visit(pre, True)
+    plan.append(nm)
+  visit(name, False)
+  return plan
+
+
+def runObjective(name):
+  '''Do objective 'name' and its prerequisites (see objectiveDag).  Each objective is
+  started, on its own thread, as soon as the ones it depends on are done.  Objectives
+  that use the device take turns with it (after adbModeFunc gets it into the mode they
+  need, if the devTracker says it isn't in it).  Returns False if any of them failed.
+  '''
+  if name not in objectiveDag:
+    logCtx.objective = name
+    return globals()[name+"Func"]()  # (Not part of the revive process, just do it)
+
+  plan = planObjective(name)
+  logp("  --objectives to do: "+' '.join(plan))
+  serial = journalSerial()
+  devArg, devState = arg.current(), state.current()
+  devLock = threading.Lock()  # Only one objective at a time talks to the device
+  cond = threading.Condition()
+  done = {}  # {objective: succeeded}
+  started = []
+
+  def deps(nm):
+    node = objectiveDag[nm]
+    return [pre for pre in node.get('needs', [])+node.get('after', []) if pre in plan]
+
+  def runNode(nm):
+    arg.bind(devArg)  # (So this thread works on, and logs for, the same device)
+    state.bind(devState)
+    logCtx.objective = nm
+    node = objectiveDag[nm]
+    startTm = time.time()
+    errs = len(state.error)
+    try:
+      if node.get('mode'):
+        with devLock:
+          if inMode(node.mode):
+            state.adbMode = node.mode  # (As adbModeFunc would have)
+            ok = True
+          else:
+            ok = adbModeFunc(node.mode)
+          ok = ok!=False and globals()[nm+"Func"]()
+      else:
+        with hostLock:  # (In a fleet run, another device may have just done it)
+          if nm!=name and node.get('done') and node.done():
+            ok = True
+          else:
+            ok = globals()[nm+"Func"]()
+    except Exception as ex:
+      state.error.append(nm+" exception: "+traceback.format_exc())
+      ok = False
+    perfStats.record(nm, "objective", nm, time.time()-startTm)
+    if ok==False:
+      state.error.append(nm+" failed")
+    elif len(state.error)>errs:  # (Partly done, the next run must do it again)
+      logp("  --"+nm+" had errors, not recording it in the journal")
+    elif 'inputs' in node and (serial or state.get('serialNo')):
+      appendJournal(serial or state.get('serialNo'), nm, node.inputs())
+    with cond:
+      done[nm] = ok!=False
+      cond.notify_all()
+
+  with cond:
+    while True:
+      if all(done.values()):  # Start whatever can be started, unless something failed
+        for nm in plan:
+          if nm not in started and all([pre in done for pre in deps(nm)]):
+            started.append(nm)
+            th = threading.Thread(target=runNode, args=(nm,))
+            th.daemon = True
+            th.start()
+      if len(done)==len(started):
+        break
+      cond.wait(1)
+  return len(done)==len(plan) and all(done.values())
+
+
 def listObjectivesFunc():
   print("\nList of objectives (phases or operations needed for revival) Case sensitive:")
   for ob in objectives:
     objName = ob[0]
     desc = ob[1]
     if desc[0]!='!':
-      print("  "+objName+"\t"+desc)
+      needs = objectiveDag.get(objName, bunch()).get('needs')
+      print("  "+objName+"\t"+desc+("  (needs: "+', '.join(needs)+")" if needs else ""))
   print("\n\nThe objectives are listed in the order they are normally preformed.\n")
 
 
-state = bunch( # Attributes are added here to indicate state or progress in objective
+state = threadBunch( # Attributes are added here to indicate state or progress in objective
   adbMode = None,
   error = [],   # A place to return a list of errors
   needed = []   # A list of messages that need to be displayed
 )
 
+# How the revive objectives depend on each other (see runObjective):
+#   needs: objectives that must be done first
+#   after: objectives that, if they are being done too, must be finished first
+#   done: function that says if it has already been done (then it is skipped, unless it
+#     was asked for by name)
+#   mode: device mode it needs (adbModeFunc targetMode), no mode means it only works on
+#     files on this computer (it doesn't take a turn with the device)
+#   inputs: function returning the md5s (etc) of the files it puts on the device.  When
+#     it is done (without any errors), that is recorded in the device's reviveMC74-<serial>.journal, and next
+#     time it is skipped (without asking the device) if they haven't changed.  The
+#     'fresh' arg ignores the journal.
+objectiveDag = bunch(
+  replaceRecovery = bunch(mode="adb", inputs=recoveryInputs),
+  backupPart = bunch(needs=["replaceRecovery"], done=rawImgDone, mode="adb"),
+  fixPart = bunch(needs=["backupPart"], done=partImgDone),
+  flashPart = bunch(needs=["replaceRecovery", "fixPart"], mode="adb", inputs=flashInputs),
+  installApps = bunch(after=["flashPart"], mode="normal", inputs=appInputs),
+  startPhone = bunch(after=["installApps"], mode="normal"),
+  revive = bunch(needs=["flashPart", "installApps", "startPhone"]),
+)
+
 # Collection of all defined objectives
 #  Note: If 'func' attribute is missing, the function is:  <objectiveName>Func
 objectives = [
@@ -995,6 +1412,8 @@ objectives = [
   ['version', "Find and record some software version info"],
   ['manual', "Place to manually invoke reviveMC74 functions (advanced users)"],
   ['resetBFF', "(manual step) Reset the 'Boot partion Fixed Flag'"],
+  ['fleet', "Run the 'goal=' objective (default revive) on all attached MC74s at once,"
+    +" or on the network MC74s listed in 'hosts='"],
   ['push', '(for developers only) Update the local repo then push changes to github'],
 ] # end of objectives
 
@@ -366,14 +366,25 @@ def execu(cmd, stdin=None, showErr=True, returnStr=True):
   return out, proc.returncode
 
 
-def execute(cmd, showErr=True, returnStr=True):
-  import subprocess
+execStats = None  # Function called (cmd, spawn secs, total secs, output size) after execute
+
+def execute(cmd, showErr=True, returnStr=True, cwd=None, started=None):
+  '''Execute an operating system command, returns [output, return code].  'started' is
+  called with the process once it is running (ie to be able to kill it).
+  '''
+  import subprocess, time
   if type(cmd)==str:
     cmd = cmd.split(' ')
     # Remove ' ' tokens caused by multiple spaces in str             
     cmd = [xx for xx in cmd if xx!='']
-  proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  startTm = time.time()
+  proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd)
+  spawnTm = time.time()
+  if started:
+    started(proc)
   out, err = proc.communicate()
+  if execStats:
+    execStats(cmd, spawnTm-startTm, time.time()-startTm, len(out)+len(err))
   if type(out)==bytes:  # Needed for python 3 (stupid python)
     out = out.decode("ISO-8859-1")
     try: